@@ -0,0 +1,91 @@
+#!/usr/bin/env python3
+from typing import Union
+import argparse
+import sys
+import numpy as np
+from numpy.typing import ArrayLike
+from canvas import IndexedCanvas, scaled_view
+from encoder import APNGWriter, RawFrameWriter
+from random_walk import walk_frames, remove_black_pixels, remove_noise
+from config import COLORS, WIDTH, HEIGHT, NUMBER_OF_STEPS, SEED
+
+Writer = Union[APNGWriter, RawFrameWriter]
+
+
+def add_frame(
+    writer: Writer,
+    y: int,
+    x: int,
+    image: ArrayLike,
+    mask: ArrayLike = None,
+    scale: int = 1,
+    duration: float = None,
+):
+    """Add the frame to the writer, scaled up by the scale."""
+    height, width = image.shape[0] * scale, image.shape[1] * scale
+    image = scaled_view(image, scale).reshape(height, width)
+    if mask is not None:
+        mask = scaled_view(mask, scale).reshape(height, width)
+    writer.add_frame(image, x * scale, y * scale, mask, duration)
+
+
+def animate(
+    writer: Writer,
+    canvas: IndexedCanvas,
+    steps_per_frame: int,
+    scale: int = 1,
+    hold: float = 2.0,
+    rng: np.random.Generator = None,
+):
+    """Write the frames of the random walk, followed by the canvas with the black pixels and noise removed.
+
+    Only the pixels painted since the previous frame are written, and the final canvas is held for hold seconds.
+    """
+    walk, black_pixels, noise = map(
+        np.random.default_rng, np.random.SeedSequence(rng).spawn(3)
+    )
+    add_frame(writer, 0, 0, canvas.indices, scale=scale)
+    for frame in walk_frames(canvas, steps_per_frame, rng=walk):
+        y, x, image, mask = frame.delta()
+        add_frame(writer, y, x, image, mask, scale)
+
+    canvas = remove_black_pixels(canvas, black_pixels)
+    add_frame(writer, 0, 0, canvas.indices, scale=scale)
+    canvas = remove_noise(canvas, verbose=False, rng=noise)
+    add_frame(writer, 0, 0, canvas.indices, scale=scale, duration=hold)
+
+
+def main():
+    """Animate the random walk, as an animated png or as raw rgb24 video frames."""
+    parser = argparse.ArgumentParser(description=main.__doc__)
+    parser.add_argument(
+        "--output",
+        default="random_walk.png",
+        help="an animated png, or '-' to write raw video to stdout, such as: python animate.py --output - | ffmpeg -f rawvideo -pix_fmt rgb24 -s 1920x1080 -r 30 -i - walk.mp4",
+    )
+    parser.add_argument("--width", type=int, default=WIDTH)
+    parser.add_argument("--height", type=int, default=HEIGHT)
+    parser.add_argument("--scale", type=int, default=1)
+    parser.add_argument("--fps", type=int, default=30)
+    parser.add_argument(
+        "--steps-per-frame",
+        type=int,
+        default=NUMBER_OF_STEPS // 1000,
+        help="the number of steps of the walk between the frames",
+    )
+    parser.add_argument("--seed", type=int, default=SEED)
+    args = parser.parse_args()
+
+    canvas = IndexedCanvas(args.width, args.height, COLORS)
+    width, height = args.width * args.scale, args.height * args.scale
+    if args.output == "-":
+        writer = RawFrameWriter(sys.stdout.buffer, width, height, canvas.palette)
+    else:
+        writer = APNGWriter(args.output, width, height, canvas.palette, args.fps)
+
+    with writer:
+        animate(writer, canvas, args.steps_per_frame, args.scale, rng=args.seed)
+
+
+if __name__ == "__main__":
+    main()
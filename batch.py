@@ -0,0 +1,369 @@
+#!/usr/bin/env python3
+from typing import Callable, Dict, List, Tuple
+from multiprocessing import Pool, Queue
+from multiprocessing.util import Finalize
+from itertools import product
+from queue import Empty
+from time import perf_counter
+import argparse
+import os
+import zlib
+import numpy as np
+from tqdm import tqdm
+from canvas import Canvas, IndexedCanvas, save_scaled
+from random_walk import multi_walker_random_walk, remove_black_pixels, remove_noise
+from nearest_neighbour import nearest_neighbour
+from sampling import sample_points
+from grid import Grid, RGB, fit_layout, load_config
+from cache import Cache
+from encoder import BackgroundEncoder
+from config import (
+    THEMES,
+    BACKGROUNDS,
+    WIDTH,
+    HEIGHT,
+    NUMBER_OF_STEPS,
+    NUMBER_OF_WALKERS,
+    TARGET_COVERAGE,
+    PROBABILITY_FOR_COLOR_TO_STAY_THE_SAME,
+    PASSES_REMOVING_NOISE,
+    CUTOF,
+    NOISE_REMOVAL,
+    MAJORITY_KERNEL_SIZE,
+    POINTS_WITH_RANDOM_COLORS,
+    SEED_SAMPLING,
+    INDEXED_CANVAS,
+    CACHE_DIRECTORY,
+)
+
+Stage = Tuple[str, Callable[[Canvas], Canvas]]
+
+
+def run_stages(canvas: Canvas, stages: List[Stage], cache: Cache, key: str) -> Canvas:
+    """Run the stages on the canvas in order, resuming from the last stage found in the cache.
+
+    The result of each stage computed is stored in the cache (unless the cache is None).
+    """
+    start = 0
+    if cache is not None:
+        for i in reversed(range(len(stages))):
+            tensor = cache.get(key, stages[i][0])
+            if tensor is not None:
+                canvas.paint(slice(None), slice(None), tensor)
+                start = i + 1
+                break
+
+    for name, stage in stages[start:]:
+        canvas = stage(canvas)
+        if cache is not None:
+            cache.put(key, name, canvas.tensor)
+
+    return canvas
+
+
+def generate_random_walk(
+    width: int,
+    height: int,
+    colors: List[Tuple[int]],
+    ratios: List[int],
+    bg: Tuple[int],
+    seed: int,
+    cache: Cache = None,
+) -> Canvas:
+    """Generate a wallpaper with the random walk, followed by the noise removal."""
+    if INDEXED_CANVAS:
+        canvas = IndexedCanvas(width, height, colors)
+    else:
+        canvas = Canvas(width, height)
+
+    # Keep the number of steps and walkers per pixel as configured for the default resolution.
+    fraction = width * height / (WIDTH * HEIGHT)
+    parameters = {
+        "number_of_walkers": max(32, int(NUMBER_OF_WALKERS * fraction)),
+        "number_of_steps": int(NUMBER_OF_STEPS * fraction),
+        "target_coverage": TARGET_COVERAGE,
+        "probability_for_color_to_stay_the_same": PROBABILITY_FOR_COLOR_TO_STAY_THE_SAME,
+        "noise_removal": NOISE_REMOVAL,
+        "passes": PASSES_REMOVING_NOISE,
+        "cutof": CUTOF,
+        "kernel_size": MAJORITY_KERNEL_SIZE,
+    }
+    key = Cache.key(
+        generator="random-walk",
+        parameters=parameters,
+        palette=[colors, ratios],
+        resolution=[width, height],
+        seed=seed,
+    )
+
+    # Each stage has its own generator, such that a stage loaded from the cache doesn't change the later stages.
+    walk, black_pixels, noise = map(
+        np.random.default_rng, np.random.SeedSequence(seed).spawn(3)
+    )
+    stages = [
+        (
+            "walk",
+            lambda canvas: multi_walker_random_walk(
+                canvas,
+                number_of_walkers=parameters["number_of_walkers"],
+                target_coverage=parameters["target_coverage"],
+                number_of_steps=parameters["number_of_steps"],
+                verbose=False,
+                colors=colors,
+                ratios=ratios,
+                rng=walk,
+            ),
+        ),
+        ("black-pixels", lambda canvas: remove_black_pixels(canvas, black_pixels)),
+        (
+            "noise",
+            lambda canvas: remove_noise(canvas, verbose=False, rng=noise),
+        ),
+    ]
+    return run_stages(canvas, stages, cache, key)
+
+
+def generate_nearest_neighbour(
+    width: int,
+    height: int,
+    colors: List[Tuple[int]],
+    ratios: List[int],
+    bg: Tuple[int],
+    seed: int,
+    cache: Cache = None,
+) -> Canvas:
+    """Generate a wallpaper by coloring each pixel with the color of the closest of a set of random points."""
+    fraction = width * height / (WIDTH * HEIGHT)
+    n = max(1, int(POINTS_WITH_RANDOM_COLORS * fraction))
+    key = Cache.key(
+        generator="nearest-neighbour",
+        parameters={"points": n, "sampling": SEED_SAMPLING, "metric": "euclidean"},
+        palette=[colors, ratios],
+        resolution=[width, height],
+        seed=seed,
+    )
+
+    def color_points(canvas: Canvas) -> Canvas:
+        """Color the canvas by the nearest of the random points."""
+        points, point_colors = sample_points(
+            SEED_SAMPLING, width, height, n, colors, ratios, seed
+        )
+        return nearest_neighbour(canvas, points, point_colors, "euclidean")
+
+    return run_stages(Canvas(width, height), [("final", color_points)], cache, key)
+
+
+def generate_grid(
+    width: int,
+    height: int,
+    colors: List[Tuple[int]],
+    ratios: List[int],
+    bg: Tuple[int],
+    seed: int,
+    cache: Cache = None,
+) -> Canvas:
+    """Generate a wallpaper of chained squares, with the gaps and sizes from config.json fitted to the resolution."""
+    cfg = load_config()
+    gap, external_gap, square_width, square_height = fit_layout(
+        width,
+        height,
+        cfg["internal-gap"],
+        cfg["external-gap"],
+        cfg["square-width"],
+        cfg["square-height"],
+        (cfg["width"], cfg["height"]),
+    )
+    key = Cache.key(
+        generator="grid",
+        parameters={
+            "internal-gap": gap,
+            "external-gap": external_gap,
+            "square-width": square_width,
+            "square-height": square_height,
+        },
+        palette=[colors, bg],
+        resolution=[width, height],
+        seed=seed,
+    )
+
+    def chain_squares(canvas: Canvas) -> Canvas:
+        """Draw the squares chained together, along with the middles."""
+        grid = Grid(
+            gap=gap,
+            external_gap=external_gap,
+            square_width=square_width,
+            square_height=square_height,
+            bg=RGB("%02x%02x%02x" % tuple(bg)),
+            colors=[RGB("%02x%02x%02x" % tuple(color)) for color in colors],
+            width=width,
+            height=height,
+            rng=seed,
+        )
+        grid.chain_squares(with_middles=True)
+        return Canvas(width, height, tensor=grid.create_image())
+
+    return run_stages(Canvas(width, height), [("final", chain_squares)], cache, key)
+
+
+GENERATORS: Dict[str, Callable[..., Canvas]] = {
+    "random-walk": generate_random_walk,
+    "nearest-neighbour": generate_nearest_neighbour,
+    "grid": generate_grid,
+}
+
+
+# The encoder of the worker, which writes a wallpaper while the next one is being generated.
+_encoder: BackgroundEncoder = None
+# The wallpapers which the encoder failed to write, as (path, error, pixels), which is read by the parent.
+_write_errors: Queue = None
+
+
+def start_encoder(write_errors: Queue):
+    """Start the encoder of the worker, the wallpapers still pending are written when the worker exits."""
+    global _encoder, _write_errors
+    _encoder = BackgroundEncoder(max_pending=1)
+    _write_errors = write_errors
+    Finalize(_encoder, _encoder.close, exitpriority=10)
+
+
+def write_wallpaper(canvas: Canvas, scale: int, path: str, pixels: int):
+    """Save the wallpaper scaled up, this runs on the encoder thread, hence the errors are sent to the parent."""
+    try:
+        save_scaled(canvas, scale, path)
+    except Exception as error:
+        _write_errors.put((path, f"{type(error).__name__}: {error}", pixels))
+
+
+def run_job(job: Tuple) -> Tuple[str, str, int, float]:
+    """Render a single wallpaper, returns the path, an error message (or None), the number of pixels and the time spent.
+
+    The wallpaper is written by the encoder of the worker, if it has been started, otherwise it's written before
+    returning. The errors of the encoder are sent through the queue given to start_encoder instead.
+    """
+    theme, generator, (width, height), scale, seed, path, cache = job
+    start = perf_counter()
+    colors_and_ratios = THEMES[theme]
+    pixels = width * height * scale**2
+    try:
+        canvas = GENERATORS[generator](
+            width,
+            height,
+            list(colors_and_ratios.keys()),
+            list(colors_and_ratios.values()),
+            BACKGROUNDS[theme],
+            seed,
+            cache,
+        )
+        if _encoder is not None:
+            _encoder.submit(write_wallpaper, canvas, scale, path, pixels)
+        else:
+            save_scaled(canvas, scale, path)
+    except Exception as error:
+        # Any error fails the job, rather than the whole batch.
+        return path, f"{type(error).__name__}: {error}", 0, perf_counter() - start
+
+    return path, None, pixels, perf_counter() - start
+
+
+def parse_resolution(resolution: str) -> Tuple[int]:
+    """Parse a resolution on the form WIDTHxHEIGHT."""
+    try:
+        width, height = resolution.lower().split("x")
+        return int(width), int(height)
+    except ValueError:
+        raise argparse.ArgumentTypeError(
+            f"Expected a resolution such as 1920x1080 got {resolution}."
+        )
+
+
+def main():
+    """Generate a batch of wallpapers, across themes, generators and resolutions."""
+    parser = argparse.ArgumentParser(description=main.__doc__)
+    parser.add_argument(
+        "-n", "--count", type=int, default=1, help="wallpapers per combination"
+    )
+    parser.add_argument("--themes", nargs="+", choices=THEMES, default=list(THEMES))
+    parser.add_argument(
+        "--generators", nargs="+", choices=GENERATORS, default=list(GENERATORS)
+    )
+    parser.add_argument(
+        "--resolutions",
+        nargs="+",
+        type=parse_resolution,
+        default=[(WIDTH, HEIGHT)],
+        help="the resolutions to render at, before scaling, such as 1920x1080",
+    )
+    parser.add_argument(
+        "--scale", type=int, default=1, help="scale the wallpapers up by this"
+    )
+    parser.add_argument("--output", default="wallpapers", help="the output directory")
+    parser.add_argument("--processes", type=int, default=os.cpu_count())
+    parser.add_argument("--seed", type=int, default=None)
+    parser.add_argument(
+        "--cache", default=CACHE_DIRECTORY, help="the directory of the image cache"
+    )
+    parser.add_argument("--no-cache", action="store_true", help="disable the cache")
+    args = parser.parse_args()
+
+    os.makedirs(args.output, exist_ok=True)
+    combinations = list(
+        product(args.themes, args.generators, args.resolutions, range(args.count))
+    )
+    # The seed of each job only depends on the job itself, such that the wallpapers don't change
+    # when the other themes, generators or resolutions are left out of the batch.
+    entropy = np.random.SeedSequence(args.seed).entropy
+    cache = None if args.no_cache else Cache(args.cache)
+    jobs = []
+    for theme, generator, (width, height), i in combinations:
+        name = f"{theme}-{generator}-{width}x{height}-{i}"
+        seed = np.random.SeedSequence([entropy, zlib.crc32(name.encode())])
+        path = os.path.join(
+            args.output,
+            f"{theme}-{generator}-{width * args.scale}x{height * args.scale}-{i:04d}.png",
+        )
+        jobs.append(
+            (
+                theme,
+                generator,
+                (width, height),
+                args.scale,
+                int(seed.generate_state(1)[0]),
+                path,
+                cache,
+            )
+        )
+
+    start = perf_counter()
+    pixels, failed = 0, []
+    write_errors = Queue()
+    with Pool(
+        args.processes, initializer=start_encoder, initargs=(write_errors,)
+    ) as pool:
+        for path, error, n, _ in tqdm(
+            pool.imap_unordered(run_job, jobs), total=len(jobs)
+        ):
+            if error is not None:
+                failed.append((path, error))
+            pixels += n
+        # Wait for the workers to exit, such that their encoders finish writing the last wallpapers.
+        pool.close()
+        pool.join()
+    while True:
+        try:
+            path, error, n = write_errors.get_nowait()
+        except Empty:
+            break
+        failed.append((path, error))
+        pixels -= n
+    elapsed = perf_counter() - start
+
+    for path, error in failed:
+        print(f"Failed to generate {path}: {error}")
+    done = len(jobs) - len(failed)
+    print(
+        f"Generated {done} wallpapers in {elapsed:.1f}s, {done / elapsed:.2f} wallpapers/s, {pixels / elapsed / 1e6:.1f} megapixels/s."
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,288 @@
+#!/usr/bin/env python3
+from typing import Any, Callable, Dict, List, Tuple
+from functools import lru_cache
+from time import perf_counter
+import argparse
+import json
+import sys
+import numpy as np
+from numpy.typing import ArrayLike
+from canvas import Canvas, IndexedCanvas, scale_up_by
+from random_walk import (
+    multi_walker_random_walk,
+    remove_black_pixels,
+    get_groups,
+    remove_blobs,
+    majority_filter,
+)
+from nearest_neighbour import nearest_neighbour
+from sampling import (
+    sample_points,
+    jittered_grid_points,
+    poisson_disc_points,
+    poisson_disc_radius,
+)
+from grid import Grid, RGB, layout
+from batch import parse_resolution
+from config import COLORS, POINTS_WITH_RANDOM_COLORS, WIDTH, HEIGHT
+
+# A benchmark takes the size of the canvas and a generator, does the setup and returns the size n,
+# which the time is expected to scale with, along with the function to time.
+Benchmark = Callable[[int, int, np.random.Generator], Tuple[int, Callable[[], Any]]]
+
+BASELINES = "benchmarks.json"
+
+
+@lru_cache(maxsize=None)
+def walked(width: int, height: int, target_coverage: float) -> ArrayLike:
+    """Return the indices of a canvas after the random walk, which is shared between the benchmarks."""
+    canvas = multi_walker_random_walk(
+        IndexedCanvas(width, height, COLORS),
+        target_coverage=target_coverage,
+        number_of_steps=40 * width * height,
+        verbose=False,
+        rng=0,
+    )
+    return canvas.indices
+
+
+@lru_cache(maxsize=None)
+def filled(width: int, height: int) -> ArrayLike:
+    """Return the indices of a canvas after the random walk, with the black pixels removed."""
+    canvas = IndexedCanvas(width, height, COLORS, walked(width, height, 0.99).copy())
+    return remove_black_pixels(canvas, rng=0).indices
+
+
+def walked_canvas(
+    width: int, height: int, target_coverage: float = 0.99, fill: bool = False
+) -> IndexedCanvas:
+    """Return a copy of the canvas after the random walk, optionally with the black pixels removed."""
+    indices = filled(width, height) if fill else walked(width, height, target_coverage)
+    return IndexedCanvas(width, height, COLORS, indices.copy())
+
+
+def bench_random_walk(width: int, height: int, rng: np.random.Generator):
+    """Time the random walk, until 99% of the canvas is painted."""
+    canvas = IndexedCanvas(width, height, COLORS)
+    return width * height, lambda: multi_walker_random_walk(
+        canvas, number_of_steps=40 * width * height, verbose=False, rng=rng
+    )
+
+
+def bench_remove_black_pixels(width: int, height: int, rng: np.random.Generator):
+    """Time removing the black pixels of a canvas, where 10% of the pixels are black."""
+    canvas = walked_canvas(width, height, target_coverage=0.9)
+    return width * height, lambda: remove_black_pixels(canvas, rng)
+
+
+def bench_get_groups(width: int, height: int, rng: np.random.Generator):
+    """Time finding the groups of the canvas."""
+    canvas = walked_canvas(width, height, fill=True)
+    return width * height, lambda: get_groups(canvas)
+
+
+def bench_remove_blobs(width: int, height: int, rng: np.random.Generator):
+    """Time two passes of removing the blobs."""
+    canvas = walked_canvas(width, height, fill=True)
+    return width * height, lambda: remove_blobs(canvas, 2, verbose=False, rng=rng)
+
+
+def bench_majority_filter(width: int, height: int, rng: np.random.Generator):
+    """Time two iterations of the majority filter."""
+    canvas = walked_canvas(width, height, fill=True)
+    return width * height, lambda: majority_filter(canvas, iterations=2)
+
+
+def bench_scale_up_by(width: int, height: int, rng: np.random.Generator):
+    """Time scaling the rgb canvas up by 4."""
+    canvas = Canvas(width, height, tensor=walked_canvas(width, height).tensor)
+    return width * height, lambda: scale_up_by(canvas, 4)
+
+
+def bench_nearest_neighbour(width: int, height: int, rng: np.random.Generator):
+    """Time the nearest neighbour, with the density of points from the config."""
+    n = max(1, POINTS_WITH_RANDOM_COLORS * width * height // (WIDTH * HEIGHT))
+    points, colors = sample_points("uniform", width, height, n, rng=rng)
+    canvas = Canvas(width, height)
+    return width * height, lambda: nearest_neighbour(canvas, points, colors)
+
+
+def bench_nearest_neighbour_points(width: int, height: int, rng: np.random.Generator):
+    """Time the nearest neighbour on a fixed canvas, with a number of points proportional to the size."""
+    n = width * height // 100
+    points, colors = sample_points("uniform", 640, 360, n, rng=rng)
+    canvas = Canvas(640, 360)
+    return n, lambda: nearest_neighbour(canvas, points, colors)
+
+
+def bench_jittered_grid_points(width: int, height: int, rng: np.random.Generator):
+    """Time drawing a point for every 20 pixels, on a jittered grid."""
+    return width * height, lambda: jittered_grid_points(
+        width, height, width * height // 20, rng
+    )
+
+
+def bench_poisson_disc_points(width: int, height: int, rng: np.random.Generator):
+    """Time drawing a Poisson disc sampling, with a point for roughly every 20 pixels."""
+    radius = poisson_disc_radius(width, height, width * height // 20)
+    return width * height, lambda: poisson_disc_points(width, height, radius, rng)
+
+
+def bench_create_image(width: int, height: int, rng: np.random.Generator):
+    """Time rendering a grid of 8x8 squares, including computing the layout."""
+    # The canvas is made slightly larger, such that the squares fits.
+    n_horizontal, n_vertical = width // 10, height // 10
+    grid = Grid(
+        gap=2,
+        external_gap=4,
+        square_width=8,
+        square_height=8,
+        colors=[RGB("%02x%02x%02x" % color) for color in COLORS],
+        bg=RGB("000000"),
+        width=10 * n_horizontal + 6,
+        height=10 * n_vertical + 6,
+        rng=rng,
+    )
+    grid.chain_squares(with_middles=True)
+
+    def create_image() -> ArrayLike:
+        """Render the grid without the cached layout."""
+        layout.cache_clear()
+        return grid.create_image()
+
+    return (10 * n_horizontal + 6) * (10 * n_vertical + 6), create_image
+
+
+BENCHMARKS: Dict[str, Benchmark] = {
+    "random_walk": bench_random_walk,
+    "remove_black_pixels": bench_remove_black_pixels,
+    "get_groups": bench_get_groups,
+    "remove_blobs": bench_remove_blobs,
+    "majority_filter": bench_majority_filter,
+    "scale_up_by": bench_scale_up_by,
+    "nearest_neighbour": bench_nearest_neighbour,
+    "nearest_neighbour_points": bench_nearest_neighbour_points,
+    "jittered_grid_points": bench_jittered_grid_points,
+    "poisson_disc_points": bench_poisson_disc_points,
+    "create_image": bench_create_image,
+}
+
+
+def run_benchmark(
+    benchmark: Benchmark, sizes: List[Tuple[int]], repeat: int
+) -> Dict[str, Any]:
+    """Time the benchmark at each size, taking the fastest of the repeats, and fit the scaling exponent.
+
+    The exponent is the slope of log(time) against log(n), ie. time ~ n^exponent.
+    """
+    ns, times = [], []
+    for width, height in sizes:
+        best = float("inf")
+        for i in range(repeat):
+            n, function = benchmark(width, height, np.random.default_rng(i))
+            start = perf_counter()
+            function()
+            best = min(best, perf_counter() - start)
+        ns.append(n)
+        times.append(best)
+
+    exponent = np.polyfit(np.log(ns), np.log(times), 1)[0] if len(ns) > 1 else None
+    return {
+        "sizes": [list(size) for size in sizes],
+        "n": ns,
+        "times": times,
+        "exponent": None if exponent is None else float(exponent),
+    }
+
+
+def compare(
+    results: Dict[str, Dict[str, Any]],
+    baselines: Dict[str, Dict[str, Any]],
+    tolerance: float,
+    exponent_tolerance: float,
+) -> List[str]:
+    """Compare the results to the baselines, returns a description of each regression."""
+    regressions = []
+    for name, result in results.items():
+        if name not in baselines:
+            continue
+        baseline = baselines[name]
+        times = dict(zip(map(tuple, baseline["sizes"]), baseline["times"]))
+        for size, time in zip(map(tuple, result["sizes"]), result["times"]):
+            if size in times and time > tolerance * times[size]:
+                regressions.append(
+                    f"{name} at {size[0]}x{size[1]} took {time:.4f}s, the baseline is {times[size]:.4f}s."
+                )
+        if (
+            result["exponent"] is not None
+            and baseline["exponent"] is not None
+            and result["exponent"] > baseline["exponent"] + exponent_tolerance
+        ):
+            regressions.append(
+                f"{name} scales as n^{result['exponent']:.2f}, the baseline is n^{baseline['exponent']:.2f}."
+            )
+
+    return regressions
+
+
+def main():
+    """Benchmark the generators at a ladder of canvas sizes, and compare the results to the baselines."""
+    parser = argparse.ArgumentParser(description=main.__doc__)
+    parser.add_argument(
+        "--sizes",
+        nargs="+",
+        type=parse_resolution,
+        default=[(160, 90), (320, 180), (640, 360), (1280, 720)],
+    )
+    parser.add_argument(
+        "--benchmarks", nargs="+", choices=BENCHMARKS, default=list(BENCHMARKS)
+    )
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument(
+        "--save", action="store_true", help="store the results as the baselines"
+    )
+    parser.add_argument(
+        "--compare", action="store_true", help="fail if slower than the baselines"
+    )
+    parser.add_argument("--baselines", default=BASELINES)
+    parser.add_argument(
+        "--tolerance",
+        type=float,
+        default=1.5,
+        help="the slowdown, relative to the baselines, which counts as a regression",
+    )
+    parser.add_argument(
+        "--exponent-tolerance",
+        type=float,
+        default=0.25,
+        help="the increase in the scaling exponent, which counts as a regression",
+    )
+    args = parser.parse_args()
+
+    results = {}
+    for name in args.benchmarks:
+        results[name] = run_benchmark(BENCHMARKS[name], args.sizes, args.repeat)
+        times = ", ".join(f"{time:.4f}s" for time in results[name]["times"])
+        exponent = results[name]["exponent"]
+        exponent = "-" if exponent is None else f"{exponent:.2f}"
+        print(f"{name:<26} n^{exponent:<6} {times}")
+
+    if args.compare:
+        with open(args.baselines, "r") as file:
+            baselines = json.load(file)
+        regressions = compare(
+            results, baselines, args.tolerance, args.exponent_tolerance
+        )
+        for regression in regressions:
+            print(f"REGRESSION: {regression}")
+
+    if args.save:
+        with open(args.baselines, "w") as file:
+            json.dump(results, file, indent=4)
+
+    if args.compare and regressions:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
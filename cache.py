@@ -0,0 +1,76 @@
+#!/usr/bin/env python3
+from typing import Optional
+import hashlib
+import json
+import os
+import numpy as np
+from numpy.typing import ArrayLike
+from config import CACHE_DIRECTORY, CACHE_SIZE
+
+
+class Cache:
+    """A content addressed cache of images on the local disk.
+
+    Each entry is an array stored as a .npy file, named by a hash of everything the image depends on,
+    and the least recently used entries are evicted once the cache grows larger than its size.
+    """
+
+    def __init__(self, directory: str = CACHE_DIRECTORY, size: int = CACHE_SIZE):
+        """Initialize the cache, the size is the maximum number of bytes stored."""
+        self.directory = directory
+        self.size = size
+        os.makedirs(directory, exist_ok=True)
+
+    @staticmethod
+    def key(**parts) -> str:
+        """Hash the parts (the generator, parameters, palette, resolution, seed ect.) into a key."""
+        text = json.dumps(parts, sort_keys=True, default=str)
+        return hashlib.sha256(text.encode()).hexdigest()
+
+    def path(self, key: str, stage: str) -> str:
+        """Return the path of the entry, for the given stage of the image."""
+        return os.path.join(self.directory, f"{key}-{stage}.npy")
+
+    def get(self, key: str, stage: str) -> Optional[ArrayLike]:
+        """Load the entry, returns None if it isn't in the cache."""
+        path = self.path(key, stage)
+        try:
+            array = np.load(path)
+            # The modification time is used as the time of the last use.
+            os.utime(path)
+        except (FileNotFoundError, ValueError, EOFError):
+            return None
+
+        return array
+
+    def put(self, key: str, stage: str, array: ArrayLike):
+        """Store the entry, evicting the least recently used entries if the cache is full."""
+        path = self.path(key, stage)
+        # Write to a temporary file first, such that other processes never see a partial entry.
+        temporary = f"{path}.{os.getpid()}.tmp"
+        with open(temporary, "wb") as file:
+            np.save(file, array)
+        os.replace(temporary, path)
+
+        self.evict()
+
+    def evict(self):
+        """Remove the least recently used entries, until the cache fits within its size."""
+        entries = []
+        for entry in os.scandir(self.directory):
+            if entry.name.endswith(".npy"):
+                try:
+                    stat = entry.stat()
+                except FileNotFoundError:
+                    continue
+                entries.append((stat.st_mtime, stat.st_size, entry.path))
+
+        total = sum(size for _, size, _ in entries)
+        for _, size, path in sorted(entries):
+            if total <= self.size:
+                break
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+            total -= size
@@ -1,9 +1,17 @@
 #!/usr/bin/env python3
 from typing import Iterable, Tuple, List, Union
-from PIL import Image
-from config import HEIGHT, WIDTH
+from config import HEIGHT, WIDTH, COMPRESS_LEVEL, COMPRESS_STRATEGY, BAND_ROWS
 import numpy as np
 from numpy.typing import ArrayLike
+from encoder import save_image
+
+
+def pack_colors(tensor: ArrayLike) -> ArrayLike:
+    """Pack the rgb values of each pixel into a single integer, so colors can be compared directly."""
+    tensor = tensor.astype(np.uint32)
+    if tensor.shape[-1] == 1:
+        return tensor[..., 0]
+    return (tensor[..., 0] << 16) | (tensor[..., 1] << 8) | tensor[..., 2]
 
 
 def adjecent_pixels(y: int, x: int) -> Iterable[Tuple[int]]:
@@ -19,6 +27,20 @@ def adjecent_pixels(y: int, x: int) -> Iterable[Tuple[int]]:
         yield (y, x + 1)
 
 
+def zeros(shape: Tuple[int], file_path: str = None) -> ArrayLike:
+    """Allocate an array of zeros, either in memory or as a memory mapped .npy file (which is created)."""
+    if file_path is None:
+        return np.zeros(shape, dtype="uint8")
+    # The file is sparse, hence the zeros aren't written to the disk.
+    return np.lib.format.open_memmap(file_path, mode="w+", dtype="uint8", shape=shape)
+
+
+def row_bands(height: int, rows: int = BAND_ROWS) -> Iterable[slice]:
+    """Iterate over the rows of a canvas, in bands of the given number of rows."""
+    for y in range(0, height, rows):
+        yield slice(y, min(y + rows, height))
+
+
 class Canvas:
     """Model a canvas."""
 
@@ -40,12 +62,28 @@ class Canvas:
         if x != self.width - 1:
             yield (y, x + 1)
 
-    def __init__(self, width: int, height: int, is_rgb: bool = True):
-        """Initialize canvas."""
+    def __init__(
+        self,
+        width: int,
+        height: int,
+        is_rgb: bool = True,
+        tensor: ArrayLike = None,
+        file_path: str = None,
+    ):
+        """Initialize canvas, optionally on top of an existing tensor (such as a shared memory buffer).
+
+        If a file path is given, the canvas is backed by a memory mapped .npy file, rather than memory.
+        """
         self.width = width
         self.height = height
         self.is_rgb = is_rgb
-        self.tensor = np.zeros((height, width, 3 if self.is_rgb else 1), dtype="uint8")
+        shape = (height, width, 3 if self.is_rgb else 1)
+        if tensor is None:
+            self.tensor = zeros(shape, file_path)
+        elif tensor.shape != shape:
+            raise ValueError(f"Expected a tensor of shape {shape} got {tensor.shape}.")
+        else:
+            self.tensor = tensor
 
     def set_pixel(self, y: int, x: int, color: Union[Tuple[int], int]):
         """Set the value of the pixel."""
@@ -60,21 +98,166 @@ class Canvas:
         """Get the color of a given pixel."""
         return self.tensor[y][x]
 
-    def save(self, file_path: str):
-        """Save the canvas to a file."""
-        img = Image.fromarray(self.tensor)
-        img.save(file_path)
+    def paint(self, ys: ArrayLike, xs: ArrayLike, colors: ArrayLike):
+        """Set the colors of the pixels at once."""
+        self.tensor[ys, xs] = colors
+
+    def get_rows(self, start: int, end: int) -> ArrayLike:
+        """Get the colors of the pixels in the rows from start to end."""
+        return self.tensor[start:end]
+
+    def to_indices(self) -> Tuple[ArrayLike, ArrayLike]:
+        """Return the index of the color of each pixel in a palette, along with the palette."""
+        _, first, indices = np.unique(
+            pack_colors(self.tensor), return_index=True, return_inverse=True
+        )
+        palette = self.tensor.reshape(-1, self.tensor.shape[-1])[first]
+        return indices.reshape(self.height, self.width), palette
+
+    def from_indices(self, indices: ArrayLike, palette: ArrayLike):
+        """Set the color of each pixel, from its index in the palette."""
+        self.tensor[:] = palette[indices]
+
+    def save(
+        self,
+        file_path: str,
+        compress_level: int = COMPRESS_LEVEL,
+        strategy: str = COMPRESS_STRATEGY,
+    ):
+        """Save the canvas to a file, see save_scaled."""
+        save_scaled(self, 1, file_path, compress_level, strategy)
+
+
+class IndexedCanvas(Canvas):
+    """Model a canvas, which stores the index of the color of each pixel in a palette.
+
+    The index 0 is reserved for black, the color of the pixels which hasn't been painted.
+    """
+
+    def __init__(
+        self,
+        width: int,
+        height: int,
+        colors: List[Tuple[int]],
+        indices: ArrayLike = None,
+        file_path: str = None,
+    ):
+        """Initialize canvas, optionally on top of an existing array of indices, or a memory mapped .npy file."""
+        if len(colors) > 255:
+            raise ValueError(f"Expected at most 255 colors got {len(colors)}.")
+        self.width = width
+        self.height = height
+        self.is_rgb = True
+        self.palette = np.array([(0, 0, 0)] + list(colors), dtype="uint8")
+        if indices is None:
+            self.indices = zeros((height, width), file_path)
+        elif indices.shape != (height, width):
+            raise ValueError(
+                f"Expected indices of shape {(height, width)} got {indices.shape}."
+            )
+        else:
+            self.indices = indices
+
+    @property
+    def tensor(self) -> ArrayLike:
+        """Expand the canvas to rgb values, note that this is a copy."""
+        return self.palette[self.indices]
+
+    def index_of_colors(self, colors: ArrayLike) -> ArrayLike:
+        """Look up the indices of the colors in the palette."""
+        keys = pack_colors(self.palette)
+        packed = pack_colors(np.asarray(colors, dtype="uint8"))
+        order = np.argsort(keys)
+        indices = order[np.minimum(np.searchsorted(keys[order], packed), len(keys) - 1)]
+        if (keys[indices] != packed).any():
+            raise ValueError("Expected the colors to be in the palette of the canvas.")
+        return indices.astype("uint8")
+
+    def set_pixel(self, y: int, x: int, color: Tuple[int]):
+        """Set the value of the pixel."""
+        if type(color) is int:
+            raise ValueError("Expected rgb value got grayscale.")
+
+        self.indices[y][x] = self.index_of_colors(color)
+
+    def get_color_of_pixel(self, y: int, x: int) -> Tuple[int]:
+        """Get the color of a given pixel."""
+        return self.palette[self.indices[y][x]]
+
+    def paint(self, ys: ArrayLike, xs: ArrayLike, colors: ArrayLike):
+        """Set the colors of the pixels at once."""
+        self.indices[ys, xs] = self.index_of_colors(colors)
+
+    def get_rows(self, start: int, end: int) -> ArrayLike:
+        """Get the colors of the pixels in the rows from start to end."""
+        return self.palette[self.indices[start:end]]
+
+    def to_indices(self) -> Tuple[ArrayLike, ArrayLike]:
+        """Return the index of the color of each pixel in a palette, along with the palette."""
+        return self.indices, self.palette
+
+    def from_indices(self, indices: ArrayLike, palette: ArrayLike):
+        """Set the color of each pixel, from its index in the palette."""
+        if palette is self.palette:
+            if indices is not self.indices:
+                self.indices[:] = indices
+        else:
+            self.indices[:] = self.index_of_colors(palette)[indices]
+
+
+def scaled_view(tensor: ArrayLike, scale: int) -> ArrayLike:
+    """Return a read only view of the tensor scaled up, with the shape (height, scale, width, scale, ...)."""
+    return np.broadcast_to(
+        tensor[:, None, :, None],
+        (tensor.shape[0], scale, tensor.shape[1], scale) + tensor.shape[2:],
+    )
 
 
 def scale_up_by(canvas: Canvas, scale: int) -> Canvas:
     """Scales up the image, on the canvas, and returns it as a new canvas"""
-    new = Canvas(canvas.width * scale, canvas.height * scale, canvas.is_rgb)
+    width, height = canvas.width * scale, canvas.height * scale
+    if isinstance(canvas, IndexedCanvas):
+        indices = scaled_view(canvas.indices, scale).reshape(height, width)
+        return IndexedCanvas(width, height, canvas.palette[1:].tolist(), indices)
+
+    tensor = scaled_view(canvas.tensor, scale).reshape(height, width, -1)
+    return Canvas(width, height, canvas.is_rgb, tensor)
+
+
+def iter_scaled_rows(
+    array: ArrayLike, scale: int, rows: int = 64
+) -> Iterable[ArrayLike]:
+    """Iterate over the array (the tensor or the indices of a canvas) scaled up, in bands covering the given number of rows."""
+    for y in range(0, array.shape[0], rows):
+        band = array[y : y + rows]
+        yield scaled_view(band, scale).reshape(
+            (band.shape[0] * scale, band.shape[1] * scale) + band.shape[2:]
+        )
+
+
+def save_scaled(
+    canvas: Canvas,
+    scale: int,
+    file_path: str,
+    compress_level: int = COMPRESS_LEVEL,
+    strategy: str = COMPRESS_STRATEGY,
+):
+    """Save the canvas scaled up, without allocating the scaled up canvas.
 
-    for (y0, x0) in canvas.pixels():
-        # Color blocks
-        color = canvas.get_color_of_pixel(y0, x0)
-        for y in range(scale * y0, scale * (y0 + 1)):
-            for x in range(scale * x0, scale * (x0 + 1)):
-                new.set_pixel(y, x, color)
+    Canvases with at most 256 colors are written as palette images, using a byte per pixel rather than three.
+    """
+    width, height = canvas.width * scale, canvas.height * scale
+    # Finding the palette of a memory mapped rgb canvas would read all of it into memory.
+    if isinstance(canvas, IndexedCanvas) or (
+        canvas.is_rgb and not isinstance(canvas.tensor, np.memmap)
+    ):
+        indices, palette = canvas.to_indices()
+        if len(palette) <= 256:
+            bands = iter_scaled_rows(indices.astype("uint8", copy=False), scale)
+            save_image(
+                file_path, width, height, bands, palette, compress_level, strategy
+            )
+            return
 
-    return new
+    bands = iter_scaled_rows(canvas.tensor, scale)
+    save_image(file_path, width, height, bands, None, compress_level, strategy)
@@ -13,27 +13,33 @@ def hex_to_rgb(hex_repr: str) -> Tuple[int]:
 
     return (r, g, b)
 
-# MODIFIED VERISON OF THE DOOM ONE COLOR SCHEME (WHICH IS BASED ON ATOM ONE / ONE DARK.)
-# NOTE: This has to be in RGB, use the hex_to_rgb function if needed.
-COLORS_AND_RATIOS = {
-    (187, 194, 207): 2,  # FG
-    (152, 190, 101): 6,  # Green
-    (236, 190, 123): 4,  # Yellow
-    (81, 175, 239): 4,  # Blue
-    (209, 147, 227): 4,  # MAGENTA
+# NOTE: The colors has to be in RGB, use the hex_to_rgb function if needed.
+THEMES = {
+    # MODIFIED VERISON OF THE DOOM ONE COLOR SCHEME (WHICH IS BASED ON ATOM ONE / ONE DARK.)
+    "doom-one": {
+        (187, 194, 207): 2,  # FG
+        (152, 190, 101): 6,  # Green
+        (236, 190, 123): 4,  # Yellow
+        (81, 175, 239): 4,  # Blue
+        (209, 147, 227): 4,  # MAGENTA
+    },
+    # GRUVBOX (DARK VERSION)
+    "gruvbox": {
+        (146, 131, 116): 2,  # BG
+        (251, 73, 52): 4,  # RED
+        (184, 187, 38): 4,  # GREEN
+        (250, 189, 47): 3,  # YELLOW
+        (131, 165, 152): 3,  # BLUE
+        (142, 192, 124): 3,  # AQUA
+        (254, 128, 25): 2,  # ORANGE
+        (235, 219, 178): 2,  # FG
+    },
 }
+# The background of each theme, used between the squares of the grid.
+BACKGROUNDS = {"doom-one": (40, 44, 52), "gruvbox": (40, 40, 40)}
 
-# GRUVBOX (DARK VERSION)
-"""COLORS_AND_RATIOS = {
-    (146, 131, 116): 2,  # BG
-    (251, 73, 52): 4,  # RED
-    (184, 187, 38): 4,  # GREEN
-    (250, 189, 47): 3,  # YELLOW
-    (131, 165, 152): 3,  # BLUE
-    (142, 192, 124): 3,  # AQUA
-    (254, 128, 25): 2,  # ORANGE
-    (235, 219, 178): 2,  # FG
-}"""
+THEME = "doom-one"  # The theme used by the scripts, batch.py can generate wallpapers for all of them.
+COLORS_AND_RATIOS = THEMES[THEME]
 
 
 COLORS = list(COLORS_AND_RATIOS.keys())
@@ -45,6 +51,26 @@ WIDTH = 1920  # SCALE
 HEIGHT = 1080 # SCALE
 CUTOF = 16  # If the group is larger than this it's not automatically given a new color.
 PASSES_REMOVING_NOISE = 2  # If you dont care about noise, set this to 0, the image generation will be much faster then.
+NOISE_REMOVAL = "blobs"  # Either "blobs" (recolor the small groups) or "majority" (a much faster majority filter).
+MAJORITY_KERNEL_SIZE = 5  # The width of the window used by the majority filter, each pass is an iteration of the filter.
 PROBABILITY_FOR_COLOR_TO_STAY_THE_SAME = 0.9998
-# NOTE: the * 100 makes sure that there aren't many black pixels after the random walk process.
-NUMBER_OF_STEPS = WIDTH * HEIGHT * 100
+NUMBER_OF_WALKERS = 256  # The number of walkers moving in lockstep, each with their own color.
+TARGET_COVERAGE = 0.99  # The walk stops once this fraction of the pixels has been painted.
+# NOTE: This is only an upper bound, with the walkers above the target coverage is usually reached after ~25 steps per pixel.
+NUMBER_OF_STEPS = WIDTH * HEIGHT * 40
+POINTS_WITH_RANDOM_COLORS = 1000  # The number of points used by the nearest neighbour script.
+SEED_SAMPLING = "uniform"  # How the points are drawn, "uniform", "jittered" (one per cell of a grid) or "poisson" (blue noise, evenly spread).
+INDEXED_CANVAS = True  # Store the index of the color of each pixel in the palette, rather than the rgb values.
+NUMBER_OF_PROCESSES = 1  # If this is larger than 1, the canvas is split into tiles which are walked in parallel.
+TILE_OVERLAP = 32  # The number of pixels each tile extends into its neighbours, to hide the seams between the tiles.
+CANVAS_FILE = None  # Set this to a path, such as "canvas.npy", to keep the canvas in a memory mapped file, for resolutions which doesn't fit in memory (the canvas is then always indexed).
+BAND_ROWS = 512  # The number of rows processed at a time, when the canvas is kept in a file.
+CACHE_DIRECTORY = ".cache"  # Where the generated images (and the intermediate images) are cached.
+CACHE_SIZE = 2 * 1024**3  # The maximum size of the cache in bytes, the least recently used images are removed first.
+SEED = None  # Set this to an integer to make the wallpapers reproducible.
+CHECKPOINT_DIRECTORY = "checkpoints"  # Where random_walk.py stores the canvas after each stage, to resume from.
+PROFILE_REPORT = None  # Set this to a path, such as "profile.json", to write a report of the time and memory spent on each stage.
+PROFILE_STAGE = None  # Set this to the name of a stage, to dump a cProfile of it to <stage>.prof.
+COMPRESS_LEVEL = 1  # The zlib level (0-9) used for the pngs, higher levels are slower and only slightly smaller.
+COMPRESS_STRATEGY = "rle"  # The zlib strategy used for the pngs, see STRATEGIES in encoder.py.
+PROFILE_MEMORY = False  # Trace the memory allocated in each stage with tracemalloc, this slows down the stages.
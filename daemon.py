@@ -0,0 +1,298 @@
+#!/usr/bin/env python3
+from typing import Dict, Tuple
+from concurrent.futures import ProcessPoolExecutor
+from urllib.parse import urlsplit, parse_qs
+import argparse
+import asyncio
+import itertools
+import json
+import os
+import signal
+import numpy as np
+from batch import GENERATORS, run_job, parse_resolution
+from config import THEMES, THEME, WIDTH, HEIGHT, SEED
+
+Key = Tuple[str, str]
+
+
+def lower_priority(niceness: int):
+    """Lower the priority of a worker, such that rendering the wallpapers never starves the desktop."""
+    os.nice(niceness)
+
+
+class Daemon:
+    """Keep a bounded queue of rendered wallpapers for each theme and generator, refilled by a pool of processes.
+
+    Each queue is refilled by its own task, which only starts rendering a wallpaper once there's room for it in
+    the queue, and the number of wallpapers being rendered by each generator at once is limited by a semaphore.
+    """
+
+    def __init__(
+        self,
+        pool: ProcessPoolExecutor,
+        keys: Tuple[Key],
+        resolution: Tuple[int],
+        scale: int,
+        directory: str,
+        prefetch: int,
+        limits: Dict[str, int],
+        seed: int = None,
+    ):
+        """Initialize the queues, the limits are the number of wallpapers each generator may render at once."""
+        self.pool = pool
+        self.resolution = resolution
+        self.scale = scale
+        self.directory = directory
+        self.queues = {key: asyncio.Queue() for key in keys}
+        # The room left in each queue, counting the wallpapers being rendered for it.
+        self.slots = {key: asyncio.Semaphore(prefetch) for key in keys}
+        self.semaphores = {
+            generator: asyncio.Semaphore(limit) for generator, limit in limits.items()
+        }
+        self.seeds = np.random.SeedSequence(seed)
+        self.numbers = itertools.count()
+        self.tasks = []
+        # The paths of the wallpapers being rendered.
+        self.rendering = set()
+
+    async def refill(self, key: Key):
+        """Render wallpapers for the queue, waiting whenever it's full.
+
+        Failed wallpapers are retried after a delay, which doubles with each failure in a row.
+        """
+        theme, generator = key
+        delay = 1
+        while True:
+            await self.slots[key].acquire()
+            seed = int(self.seeds.spawn(1)[0].generate_state(1)[0])
+            path = os.path.join(
+                self.directory, f"{theme}-{generator}-{next(self.numbers):06d}.png"
+            )
+            job = (theme, generator, self.resolution, self.scale, seed, path, None)
+            self.rendering.add(path)
+            async with self.semaphores[generator]:
+                loop = asyncio.get_running_loop()
+                path, error, _, elapsed = await loop.run_in_executor(
+                    self.pool, run_job, job
+                )
+            self.rendering.discard(path)
+
+            if error is not None:
+                print(f"Failed to generate {theme}-{generator}: {error}")
+                self.slots[key].release()
+                await asyncio.sleep(delay)
+                delay = min(2 * delay, 300)
+                continue
+
+            delay = 1
+            print(f"Generated {path} in {elapsed:.1f}s.")
+            self.queues[key].put_nowait(path)
+
+    def start(self):
+        """Start refilling the queues."""
+        self.tasks = [asyncio.create_task(self.refill(key)) for key in self.queues]
+
+    async def stop(self):
+        """Stop refilling the queues and shut down the pool, and remove the wallpapers which were never served.
+
+        Cancelling the tasks doesn't stop the renders which have already started, hence the pool is shut down
+        before the wallpapers they wrote are removed.
+        """
+        for task in self.tasks:
+            task.cancel()
+        await asyncio.gather(*self.tasks, return_exceptions=True)
+        await asyncio.to_thread(self.pool.shutdown, cancel_futures=True)
+        for path in self.rendering:
+            if os.path.exists(path):
+                os.remove(path)
+        self.rendering.clear()
+        for queue in self.queues.values():
+            while not queue.empty():
+                os.remove(queue.get_nowait())
+
+    async def next(self, key: Key) -> bytes:
+        """Return the next wallpaper of the queue, waiting for one to be rendered if it's empty."""
+        path = await self.queues[key].get()
+        self.slots[key].release()
+        try:
+            with open(path, "rb") as file:
+                return file.read()
+        finally:
+            os.remove(path)
+
+    def status(self) -> Dict[str, int]:
+        """Return the number of wallpapers ready in each queue."""
+        return {
+            f"{theme}/{generator}": queue.qsize()
+            for (theme, generator), queue in self.queues.items()
+        }
+
+    async def handle(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        """Handle a http request, GET /next?theme=...&generator=... returns the next wallpaper as a png.
+
+        The theme and generator defaults to the first ones served, and GET /status returns the queue sizes.
+        """
+        try:
+            request = (await reader.readline()).decode("latin-1").split()
+            while (await reader.readline()).strip():
+                pass  # The headers are ignored.
+
+            if len(request) < 2 or request[0] != "GET":
+                await respond(writer, 405, b"Only GET is supported.\n")
+                return
+
+            url = urlsplit(request[1])
+            query = {name: values[0] for name, values in parse_qs(url.query).items()}
+            if url.path == "/status":
+                body = json.dumps(self.status(), indent=4).encode() + b"\n"
+                await respond(writer, 200, body, "application/json")
+            elif url.path == "/next":
+                default = next(iter(self.queues))
+                key = (
+                    query.get("theme", default[0]),
+                    query.get("generator", default[1]),
+                )
+                if key not in self.queues:
+                    await respond(writer, 404, f"Not serving {key}.\n".encode())
+                else:
+                    await respond(writer, 200, await self.next(key), "image/png")
+            else:
+                await respond(writer, 404, b"Expected /next or /status.\n")
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            writer.close()
+
+
+REASONS = {200: "OK", 404: "Not Found", 405: "Method Not Allowed"}
+
+
+async def respond(
+    writer: asyncio.StreamWriter,
+    status: int,
+    body: bytes,
+    content_type: str = "text/plain",
+):
+    """Write a http response, and wait for it to be sent."""
+    writer.write(
+        (
+            f"HTTP/1.1 {status} {REASONS[status]}\r\n"
+            f"Content-Type: {content_type}\r\n"
+            f"Content-Length: {len(body)}\r\n"
+            "Connection: close\r\n\r\n"
+        ).encode()
+        + body
+    )
+    await writer.drain()
+
+
+def parse_limit(limit: str) -> Tuple[str, int]:
+    """Parse a limit on the form GENERATOR=N."""
+    try:
+        generator, n = limit.split("=")
+        if generator not in GENERATORS:
+            raise ValueError
+        return generator, int(n)
+    except ValueError:
+        raise argparse.ArgumentTypeError(
+            f"Expected a limit such as random-walk=1 got {limit}."
+        )
+
+
+async def serve(args: argparse.Namespace):
+    """Run the daemon, until it's interrupted."""
+    os.makedirs(args.output, exist_ok=True)
+    limits = {generator: 1 for generator in GENERATORS}
+    limits.update(dict(args.limits))
+    keys = tuple(
+        (theme, generator) for theme in args.themes for generator in args.generators
+    )
+
+    with ProcessPoolExecutor(
+        args.processes, initializer=lower_priority, initargs=(args.nice,)
+    ) as pool:
+        daemon = Daemon(
+            pool,
+            keys,
+            args.resolution,
+            args.scale,
+            args.output,
+            args.prefetch,
+            limits,
+            args.seed,
+        )
+        servers = []
+        if args.socket is not None:
+            servers.append(await asyncio.start_unix_server(daemon.handle, args.socket))
+            print(f"Serving on {args.socket}.")
+        if args.port is not None:
+            servers.append(
+                await asyncio.start_server(daemon.handle, "127.0.0.1", args.port)
+            )
+            print(f"Serving on http://127.0.0.1:{args.port}/next.")
+
+        stop = asyncio.Event()
+        loop = asyncio.get_running_loop()
+        for signal_number in (signal.SIGINT, signal.SIGTERM):
+            loop.add_signal_handler(signal_number, stop.set)
+
+        daemon.start()
+        await stop.wait()
+
+        for server in servers:
+            server.close()
+            await server.wait_closed()
+        await daemon.stop()
+
+    if args.socket is not None and os.path.exists(args.socket):
+        os.remove(args.socket)
+
+
+def main():
+    """Pre-render wallpapers in the background, and serve them over http on a unix socket or a local port."""
+    parser = argparse.ArgumentParser(description=main.__doc__)
+    parser.add_argument("--themes", nargs="+", choices=THEMES, default=[THEME])
+    parser.add_argument(
+        "--generators", nargs="+", choices=GENERATORS, default=list(GENERATORS)
+    )
+    parser.add_argument("--resolution", type=parse_resolution, default=(WIDTH, HEIGHT))
+    parser.add_argument("--scale", type=int, default=1)
+    parser.add_argument(
+        "--prefetch",
+        type=int,
+        default=2,
+        help="the number of wallpapers kept ready for each theme and generator",
+    )
+    parser.add_argument(
+        "--processes",
+        type=int,
+        default=max(1, (os.cpu_count() or 1) // 2),
+        help="the number of wallpapers rendered at once",
+    )
+    parser.add_argument(
+        "--limits",
+        nargs="+",
+        type=parse_limit,
+        default=[],
+        help="the number of wallpapers each generator may render at once, such as random-walk=2, the default is 1",
+    )
+    parser.add_argument(
+        "--nice", type=int, default=10, help="lower the priority of the workers by this"
+    )
+    parser.add_argument("--socket", default=None, help="the path of a unix socket")
+    parser.add_argument("--port", type=int, default=None)
+    parser.add_argument(
+        "--output",
+        default="prefetched",
+        help="the directory of the wallpapers, which are ready",
+    )
+    parser.add_argument("--seed", type=int, default=SEED)
+    args = parser.parse_args()
+    if args.socket is None and args.port is None:
+        parser.error("Expected either --socket or --port.")
+
+    asyncio.run(serve(args))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,361 @@
+#!/usr/bin/env python3
+from typing import Callable, Iterable, BinaryIO
+from queue import Queue
+from threading import Thread
+import os
+import struct
+import zlib
+import numpy as np
+from numpy.typing import ArrayLike
+from PIL import Image
+from config import COMPRESS_LEVEL, COMPRESS_STRATEGY
+
+PNG_SIGNATURE = b"\x89PNG\r\n\x1a\n"
+
+# The zlib strategies, "rle" only looks for repeats of the previous byte, which is as fast as level 1 of
+# the default strategy, but compresses the large areas of a single color better than level 6.
+STRATEGIES = {
+    "default": zlib.Z_DEFAULT_STRATEGY,
+    "filtered": zlib.Z_FILTERED,
+    "huffman": zlib.Z_HUFFMAN_ONLY,
+    "rle": zlib.Z_RLE,
+    "fixed": zlib.Z_FIXED,
+}
+
+# The formats other than png, which are written by pillow (if it was built with support for them).
+LOSSLESS_FORMATS = {".webp": "WEBP", ".qoi": "QOI"}
+
+
+def write_chunk(file: BinaryIO, kind: bytes, data: bytes):
+    """Write a single png chunk."""
+    file.write(struct.pack(">I", len(data)))
+    file.write(kind)
+    file.write(data)
+    file.write(struct.pack(">I", zlib.crc32(data, zlib.crc32(kind))))
+
+
+def filter_rows(image: ArrayLike) -> bytes:
+    """Prepend each row of the image (of shape (rows, width, channels)) with the filter type, which is 0 (None)."""
+    rows = np.zeros((image.shape[0], 1 + image[0].size), dtype="uint8")
+    rows[:, 1:] = image.reshape(image.shape[0], -1)
+    return rows.tobytes()
+
+
+def write_png(
+    file_path: str,
+    width: int,
+    height: int,
+    bands: Iterable[ArrayLike],
+    compress_level: int = COMPRESS_LEVEL,
+    strategy: str = COMPRESS_STRATEGY,
+    palette: ArrayLike = None,
+):
+    """Write a png, one band of rows at a time, such that the full image is never held in memory.
+
+    The bands are arrays of shape (rows, width, 3) for rgb images, or (rows, width, 1) for grayscale images.
+    If a palette (of at most 256 rgb colors) is given, the bands are the indices of the colors in the palette,
+    of shape (rows, width), and the png is written in palette mode, using a single byte per pixel.
+    """
+    compressor = zlib.compressobj(
+        compress_level, zlib.DEFLATED, 15, 8, STRATEGIES[strategy]
+    )
+    written = 0
+    with open(file_path, "wb") as file:
+        file.write(PNG_SIGNATURE)
+        for band in bands:
+            band = np.asarray(band, dtype="uint8")
+            if palette is not None:
+                band = band.reshape(band.shape[0], width, 1)
+            if written == 0:
+                color_type = 3 if palette is not None else {1: 0, 3: 2}[band.shape[-1]]
+                write_chunk(
+                    file,
+                    b"IHDR",
+                    struct.pack(">IIBBBBB", width, height, 8, color_type, 0, 0, 0),
+                )
+                if palette is not None:
+                    palette = np.asarray(palette, dtype="uint8")
+                    if len(palette) > 256:
+                        raise ValueError(
+                            f"Expected at most 256 colors got {len(palette)}."
+                        )
+                    write_chunk(file, b"PLTE", palette.tobytes())
+
+            data = compressor.compress(filter_rows(band))
+            if data:
+                write_chunk(file, b"IDAT", data)
+            written += band.shape[0]
+
+        if written != height:
+            raise ValueError(f"Expected {height} rows got {written}.")
+        write_chunk(file, b"IDAT", compressor.flush())
+        write_chunk(file, b"IEND", b"")
+
+
+class APNGWriter:
+    """Write an animated png one frame at a time, such that only the current frame is held in memory.
+
+    The number of frames isn't known up front, hence the acTL chunk is written with 0 frames, and patched once
+    the writer is closed. If a palette is given, the frames are palette indices, and a transparent color is
+    added to the palette, such that the pixels which hasn't changed can be left out of a frame.
+    """
+
+    def __init__(
+        self,
+        file_path: str,
+        width: int,
+        height: int,
+        palette: ArrayLike = None,
+        fps: int = 30,
+        loops: int = 0,
+        compress_level: int = COMPRESS_LEVEL,
+        strategy: str = COMPRESS_STRATEGY,
+    ):
+        """Initialize the writer and write the header, loops is the number of times to play the animation (0 is forever)."""
+        self.width = width
+        self.height = height
+        self.fps = fps
+        self.loops = loops
+        self.compress_level = compress_level
+        self.strategy = strategy
+        self.frames = 0
+        self.sequence = 0
+        self.transparent = None
+
+        self.file = open(file_path, "wb")
+        self.file.write(PNG_SIGNATURE)
+        color_type = 2 if palette is None else 3
+        write_chunk(
+            self.file,
+            b"IHDR",
+            struct.pack(">IIBBBBB", width, height, 8, color_type, 0, 0, 0),
+        )
+        if palette is not None:
+            palette = np.asarray(palette, dtype="uint8")
+            if len(palette) > 255:
+                raise ValueError(
+                    f"Expected at most 255 colors got {len(palette)}, as one is used for transparency."
+                )
+            self.transparent = len(palette)
+            write_chunk(self.file, b"PLTE", palette.tobytes() + bytes(3))
+            write_chunk(self.file, b"tRNS", bytes([255]) * len(palette) + bytes(1))
+
+        self.actl = self.file.tell()
+        write_chunk(self.file, b"acTL", struct.pack(">II", 0, loops))
+
+    def add_frame(
+        self,
+        image: ArrayLike,
+        x: int = 0,
+        y: int = 0,
+        mask: ArrayLike = None,
+        duration: float = None,
+    ):
+        """Add a frame, which replaces the pixels of the image with its top left corner at (x, y).
+
+        The image is of shape (height, width) for palette indices, or (height, width, 3) otherwise. If a mask is
+        given, only the pixels in the mask are replaced, this requires a palette. The frame is shown for the
+        duration in seconds, or a single frame at the frame rate. The first frame must cover the whole image.
+        """
+        image = np.asarray(image, dtype="uint8")
+        height, width = image.shape[:2]
+        if width == 0 or height == 0:
+            raise ValueError("Expected a frame of at least a single pixel.")
+        if self.frames == 0 and (x, y, width, height) != (
+            0,
+            0,
+            self.width,
+            self.height,
+        ):
+            raise ValueError("Expected the first frame to cover the whole image.")
+
+        blend = 0  # APNG_BLEND_OP_SOURCE, the pixels of the frame replaces the pixels below.
+        if mask is not None:
+            if self.transparent is None:
+                raise ValueError("Expected a palette, when the frame has a mask.")
+            # APNG_BLEND_OP_OVER, the transparent pixels outside of the mask are left as they were.
+            image, blend = np.where(mask, image, self.transparent), 1
+        image = image.reshape(height, width, -1)
+
+        numerator, denominator = (
+            (1, self.fps) if duration is None else (round(duration * 1000), 1000)
+        )
+        write_chunk(
+            self.file,
+            b"fcTL",
+            struct.pack(
+                ">IIIIIHHBB",
+                self.sequence,
+                width,
+                height,
+                x,
+                y,
+                numerator,
+                denominator,
+                0,  # APNG_DISPOSE_OP_NONE, the frame is left on the canvas.
+                blend,
+            ),
+        )
+        self.sequence += 1
+
+        compressor = zlib.compressobj(
+            self.compress_level, zlib.DEFLATED, 15, 8, STRATEGIES[self.strategy]
+        )
+        data = compressor.compress(filter_rows(image)) + compressor.flush()
+        # The first frame is the default image, shown by decoders which doesn't support animation.
+        if self.frames == 0:
+            write_chunk(self.file, b"IDAT", data)
+        else:
+            write_chunk(self.file, b"fdAT", struct.pack(">I", self.sequence) + data)
+            self.sequence += 1
+        self.frames += 1
+
+    def close(self):
+        """Finish the animation, and write the number of frames to the acTL chunk."""
+        if self.file.closed:
+            return
+        write_chunk(self.file, b"IEND", b"")
+        self.file.seek(self.actl)
+        write_chunk(self.file, b"acTL", struct.pack(">II", self.frames, self.loops))
+        self.file.close()
+
+    def __enter__(self) -> "APNGWriter":
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+class RawFrameWriter:
+    """Write the frames as raw rgb24 video, such as to the stdin of ffmpeg, with the same interface as APNGWriter.
+
+    Raw video only has whole frames, hence the last frame is kept in memory, and the frames are applied to it.
+    """
+
+    def __init__(
+        self, file: BinaryIO, width: int, height: int, palette: ArrayLike = None
+    ):
+        """Initialize the writer, the file is a binary file (or pipe) opened for writing."""
+        self.file = file
+        self.palette = None if palette is None else np.asarray(palette, dtype="uint8")
+        self.frame = np.zeros((height, width, 3), dtype="uint8")
+        self.frames = 0
+
+    def add_frame(
+        self,
+        image: ArrayLike,
+        x: int = 0,
+        y: int = 0,
+        mask: ArrayLike = None,
+        duration: float = None,
+    ):
+        """Add a frame, see APNGWriter.add_frame, the duration is ignored as raw video has a fixed frame rate."""
+        image = np.asarray(image, dtype="uint8")
+        if self.palette is not None:
+            image = self.palette[image]
+        height, width = image.shape[:2]
+        window = self.frame[y : y + height, x : x + width]
+        if mask is None:
+            window[:] = image
+        else:
+            window[mask] = image[mask]
+        self.file.write(self.frame.tobytes())
+        self.frames += 1
+
+    def close(self):
+        """Flush the frames written."""
+        self.file.flush()
+
+    def __enter__(self) -> "RawFrameWriter":
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def save_image(
+    file_path: str,
+    width: int,
+    height: int,
+    bands: Iterable[ArrayLike],
+    palette: ArrayLike = None,
+    compress_level: int = COMPRESS_LEVEL,
+    strategy: str = COMPRESS_STRATEGY,
+):
+    """Save the bands of an image, in the format given by the extension of the file path.
+
+    Pngs are streamed by write_png, .webp and .qoi are written losslessly by pillow, as is every
+    other format pillow supports (such as jpeg), these are assembled in memory first.
+    """
+    extension = os.path.splitext(file_path)[1].lower()
+    if extension == ".png":
+        write_png(file_path, width, height, bands, compress_level, strategy, palette)
+        return
+
+    Image.init()  # Register the formats pillow was built with.
+    if extension in LOSSLESS_FORMATS and LOSSLESS_FORMATS[extension] not in Image.SAVE:
+        raise ValueError(f"Pillow can't write {extension} files.")
+
+    image = np.concatenate([np.asarray(band, dtype="uint8") for band in bands])
+    if palette is not None:
+        palette = np.asarray(palette, dtype="uint8")
+        img = Image.fromarray(image.reshape(height, width), "P")
+        img.putpalette(palette.tobytes())
+        # Most formats doesn't support palettes (jpeg, qoi), or converts them to rgb anyways.
+        img = img.convert("RGB")
+    else:
+        image = image.reshape(height, width, -1)
+        img = Image.fromarray(image[..., 0] if image.shape[-1] == 1 else image)
+
+    if extension == ".webp":
+        # The compression level is mapped onto the method of the webp encoder, 0 (fastest) to 6.
+        img.save(file_path, lossless=True, method=min(6, compress_level * 2 // 3))
+    else:
+        img.save(file_path)
+
+
+class BackgroundEncoder:
+    """Encode images on a background thread, such that the next image can be computed in the meantime.
+
+    zlib (and pillow) releases the GIL while compressing, hence the encoding runs in parallel with numpy.
+    At most max_pending images are queued, after which submit blocks, to bound the memory used.
+    """
+
+    def __init__(self, max_pending: int = 2):
+        """Initialize the encoder and start its thread."""
+        self.queue = Queue(max_pending)
+        self.errors = []
+        self.thread = Thread(target=self._run, daemon=True)
+        self.thread.start()
+
+    def _run(self):
+        """Run the submitted functions, until None is submitted."""
+        while (item := self.queue.get()) is not None:
+            function, args, kwargs = item
+            try:
+                function(*args, **kwargs)
+            except Exception as error:
+                self.errors.append(error)
+
+    def submit(self, function: Callable, *args, **kwargs):
+        """Run the function (such as Canvas.save or save_scaled) on the background thread.
+
+        NOTE: The arrays passed to the function mustn't be modified until it has run.
+        """
+        if not self.thread.is_alive():
+            raise RuntimeError("The encoder has been closed.")
+        self.queue.put((function, args, kwargs))
+
+    def close(self):
+        """Wait for the submitted images to be written, raises the first error if any of them failed."""
+        if self.thread.is_alive():
+            self.queue.put(None)
+            self.thread.join()
+        if self.errors:
+            raise self.errors[0]
+
+    def __enter__(self) -> "BackgroundEncoder":
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
@@ -1,13 +1,26 @@
 #!/usr/bin/env python3
 from dataclasses import dataclass
 import numpy as np
+from numpy.lib.stride_tricks import sliding_window_view
 from numpy.typing import ArrayLike
-from PIL import Image
-import random
-from typing import List, Dict, Tuple
-import math
+from typing import Any, Dict, List, Tuple
+from functools import lru_cache
+import argparse
 import json
 import os
+from encoder import write_png
+from labeling import connected_components
+from profiling import Profiler, count
+from config import PROFILE_REPORT, PROFILE_STAGE, PROFILE_MEMORY
+
+# The gaps and sizes of the squares, next to this script such that it doesn't matter where it's run from.
+CONFIG_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "config.json")
+
+
+def load_config(file_path: str = CONFIG_FILE) -> Dict[str, Any]:
+    """ Loads the gaps, sizes and colors of the grid """
+    with open(file_path, "r") as file:
+        return json.load(file)
 
 
 @dataclass()
@@ -27,14 +40,6 @@ class RGB:
         return np.array([self.r, self.g, self.b], dtype=np.uint8)
 
 
-def colors_match(c1: ArrayLike, c2: ArrayLike) -> bool:
-    """ Check that colors match """
-    if c1[0] == c2[0] and c1[1] == c2[1] and c1[2] == c2[2]:
-        return True
-    else:
-        return False
-
-
 class Grid:
     """ Creates a grid """
 
@@ -48,6 +53,7 @@ class Grid:
         bg: RGB,
         width: int = 1920,
         height: int = 1080,
+        rng: np.random.Generator = None,
     ):
         """ Initializes the grid & checks that the gaps and sizes match """
         # 1. Check width & heihgt matches with the gaps & sizes
@@ -68,131 +74,75 @@ class Grid:
         self.colors = colors
         self.bg = bg
 
+        # The cells store indices into the palette, where 0 is the background.
+        self.palette = np.array(
+            [bg.to_np_array()] + [c.to_np_array() for c in colors], dtype=np.uint8
+        )
+
         # Compute the number of squares in the vertical and horizontal direction
         self.n_vertical = (height - 2 * external_gap + gap) // (square_height + gap)
         self.n_horizontal = (width - 2 * external_gap + gap) // (square_width + gap)
 
-        self.squares = np.full(
-            (self.n_vertical, self.n_horizontal, 3), bg.to_np_array()
+        # Give squares a random color
+        rng = np.random.default_rng(rng)
+        self.squares = rng.integers(
+            1, len(colors) + 1, size=(self.n_vertical, self.n_horizontal)
         )  # Goes square, gap, square, gap, square ect.
-        self.horizontal_gaps = np.full(
-            (self.n_vertical - 1, self.n_horizontal, 3), bg.to_np_array()
+        self.horizontal_gaps = np.zeros(
+            (self.n_vertical - 1, self.n_horizontal), dtype=self.squares.dtype
         )
-        self.vertical_gaps = np.full(
-            (self.n_vertical, self.n_horizontal - 1, 3), bg.to_np_array()
+        self.vertical_gaps = np.zeros(
+            (self.n_vertical, self.n_horizontal - 1), dtype=self.squares.dtype
         )
-        self.middle_gaps = np.full(
-            (self.n_vertical - 1, self.n_horizontal - 1, 3), bg.to_np_array()
+        self.middle_gaps = np.zeros(
+            (self.n_vertical - 1, self.n_horizontal - 1), dtype=self.squares.dtype
         )
 
-        # Give squares a randcom color
-        for i in range(self.n_vertical):
-            for j in range(self.n_horizontal):
-                if colors_match(self.squares[i][j], self.bg.to_np_array()):
-                    self.squares[i][j] = random.choice(self.colors).to_np_array()
-
     def chain_vertical(self):
         """ Chains the squares together in the horizontal direction """
-        for i in range(self.n_vertical - 1):
-            for j in range(self.n_horizontal):
-                if colors_match(self.squares[i][j], self.squares[i + 1][j]):
-                    self.horizontal_gaps[i][j] = self.squares[i][j]
+        match = self.squares[:-1, :] == self.squares[1:, :]
+        self.horizontal_gaps[match] = self.squares[:-1, :][match]
+        count("chained_gaps", np.count_nonzero(match))
 
     def chain_horizontal(self):
         """ Chains the squares together in the veritcal direction """
-        for i in range(self.n_vertical):
-            for j in range(self.n_horizontal - 1):
-                if colors_match(self.squares[i][j], self.squares[i][j + 1]):
-                    self.vertical_gaps[i][j] = self.squares[i][j]
+        match = self.squares[:, :-1] == self.squares[:, 1:]
+        self.vertical_gaps[match] = self.squares[:, :-1][match]
+        count("chained_gaps", np.count_nonzero(match))
 
     def chain_squares(self, with_middles: bool = False):
         """ Chains squares together if they share the samme color """
         self.chain_horizontal()
         self.chain_vertical()
-        # Add middle gaps
+        # Add middle gaps, where all four squares around the middle share a color
         if with_middles:
-            for i in range(self.n_vertical - 1):
-                for j in range(self.n_horizontal - 1):
-                    if (
-                        colors_match(self.squares[i][j], self.squares[i][j + 1])
-                        and colors_match(
-                            self.squares[i + 1][j], self.squares[i + 1][j + 1]
-                        )
-                        and colors_match(self.squares[i][j], self.squares[i + 1][j])
-                    ):
-                        self.middle_gaps[i][j] = self.squares[i][j]
-
-    def _add_squares(self, bitmap: ArrayLike) -> ArrayLike:
-        """ Adds the squares to the bitmap """
-        for i in range(self.n_vertical):
-            for j in range(self.n_horizontal):
-                # Get the color check the other colors
-                color = self.squares[i][j]
-                start_i, start_j = (
-                    i * (self.square_height + self.gap) + self.external_gap,
-                    j * (self.square_width + self.gap) + self.external_gap,
-                )
-                for idx in range(start_i, start_i + self.square_height):
-                    for jdx in range(start_j, start_j + self.square_width):
-                        bitmap[idx][jdx] = color
-
-        return bitmap
-
-    def _add_horizontal_gaps(self, bitmap: ArrayLike) -> ArrayLike:
-        """ Adds the horizontal gaps to the bitmap """
-        for i in range(self.n_vertical - 1):
-            for j in range(self.n_horizontal):
-                color = self.horizontal_gaps[i][j]
-                start_i, start_j = (
-                    i * (self.square_height + self.gap)
-                    + self.external_gap
-                    + self.square_height,
-                    j * (self.square_width + self.gap) + self.external_gap,
-                )
-                for idx in range(start_i, start_i + self.gap):
-                    for jdx in range(start_j, start_j + self.square_width):
-                        bitmap[idx][jdx] = color
-
-        return bitmap
-
-    def _add_vertical_gaps(self, bitmap: ArrayLike) -> ArrayLike:
-        """ Adds the vertical gaps to the bitmap """
-        for i in range(self.n_vertical):
-            for j in range(self.n_horizontal - 1):
-                color = self.vertical_gaps[i][j]
-                start_i, start_j = (
-                    i * (self.square_height + self.gap) + self.external_gap,
-                    j * (self.square_width + self.gap)
-                    + self.external_gap
-                    + self.square_width,
-                )
-                for idx in range(start_i, start_i + self.square_height):
-                    for jdx in range(start_j, start_j + self.gap):
-                        bitmap[idx][jdx] = color
-
-        return bitmap
-
-    def _add_middle_gaps(self, bitmap: ArrayLike) -> ArrayLike:
-        """ Adds the vertical gaps to the bitmap """
-        for i in range(self.n_vertical - 1):
-            for j in range(self.n_horizontal - 1):
-                color = self.middle_gaps[i][j]
-                start_i, start_j = (
-                    i * (self.square_height + self.gap)
-                    + self.external_gap
-                    + self.square_height,
-                    j * (self.square_width + self.gap)
-                    + self.external_gap
-                    + self.square_width,
-                )
-                for idx in range(start_i, start_i + self.gap):
-                    for jdx in range(start_j, start_j + self.gap):
-                        bitmap[idx][jdx] = color
-
-        return bitmap
+            window = sliding_window_view(self.squares, (2, 2))
+            match = (window == window[:, :, :1, :1]).all(axis=(2, 3))
+            self.middle_gaps[match] = self.squares[:-1, :-1][match]
+            count("chained_middles", np.count_nonzero(match))
 
-    def create_image(self) -> ArrayLike:
-        """ Creates the image """
+    def regions(self) -> Tuple[ArrayLike, ArrayLike, ArrayLike]:
+        """ Finds the blobs of squares, which are chained together through the gaps
+
+        Returns the label of each square (numbered in row major order), along with the palette index and the number of squares of each blob.
+        """
+        index = np.arange(self.n_vertical * self.n_horizontal).reshape(
+            self.n_vertical, self.n_horizontal
+        )
+        vertical = self.horizontal_gaps != 0
+        horizontal = self.vertical_gaps != 0
+        a = np.concatenate([index[:-1, :][vertical], index[:, :-1][horizontal]])
+        b = np.concatenate([index[1:, :][vertical], index[:, 1:][horizontal]])
+
+        roots = connected_components(index.size, a, b)
+        is_root = roots == np.arange(index.size)
+        labels = (np.cumsum(is_root) - 1)[roots].reshape(index.shape)
+        sizes = np.bincount(labels.ravel(), minlength=is_root.sum())
+
+        return labels, self.squares.ravel()[is_root], sizes
+
+    def _cells_and_layout(self) -> Tuple[ArrayLike, ArrayLike]:
+        """ Returns the palette index of each cell, along with the cell of each pixel """
         height = (
             self.n_vertical * (self.gap + self.square_height)
             - self.gap
@@ -204,17 +154,157 @@ class Grid:
             + 2 * self.external_gap
         )
 
-        bitmap = np.full((height, width, 3), self.bg.to_np_array(), dtype=np.uint8)
-        return self._add_middle_gaps(
-            self._add_horizontal_gaps(
-                self._add_vertical_gaps(self._add_squares(bitmap))
-            )
+        # The palette indices in the order used by the layout, starting with the background.
+        cells = np.concatenate(
+            [
+                [0],
+                self.squares.ravel(),
+                self.horizontal_gaps.ravel(),
+                self.vertical_gaps.ravel(),
+                self.middle_gaps.ravel(),
+            ]
+        )
+        index = layout(
+            self.gap,
+            self.external_gap,
+            self.square_width,
+            self.square_height,
+            width,
+            height,
         )
+        return cells, index
 
+    def create_image(self) -> ArrayLike:
+        """ Creates the image """
+        cells, index = self._cells_and_layout()
+        return self.palette[cells][index]
 
-if __name__ == "__main__":
-    with open(os.path.join(os.getcwd(), "config.json"), "r") as file:
-        cfg = json.load(file)
+    def create_indices(self) -> ArrayLike:
+        """ Creates the image as the palette index of each pixel, which is a third of the size of the image """
+        cells, index = self._cells_and_layout()
+        return cells.astype("uint8")[index]
+
+
+@lru_cache(maxsize=8)
+def layout(
+    gap: int,
+    external_gap: int,
+    square_width: int,
+    square_height: int,
+    width: int,
+    height: int,
+) -> ArrayLike:
+    """ Maps each pixel to the square, gap or middle gap it belongs to (0 is the background)
+
+    The squares, horizontal gaps, vertical gaps and middle gaps are numbered in that order, each in row major order.
+    """
+
+    def split(length: int, size: int) -> Tuple[ArrayLike, ArrayLike, ArrayLike]:
+        """ Finds the cell of each pixel along an axis, and whether it's in a square or a gap """
+        position = np.arange(length) - external_gap
+        cell, offset = np.divmod(position, size + gap)
+        inside = (position >= 0) & (np.arange(length) < length - external_gap)
+        return cell, inside & (offset < size), inside & (offset >= size)
+
+    row, square_row, gap_row = split(height, square_height)
+    column, square_column, gap_column = split(width, square_width)
+    n_vertical = (height - 2 * external_gap + gap) // (square_height + gap)
+    n_horizontal = (width - 2 * external_gap + gap) // (square_width + gap)
+
+    row, column = row[:, None], column[None, :]
+    square_row, gap_row = square_row[:, None], gap_row[:, None]
+    square_column, gap_column = square_column[None, :], gap_column[None, :]
+
+    squares = 1
+    horizontal_gaps = squares + n_vertical * n_horizontal
+    vertical_gaps = horizontal_gaps + (n_vertical - 1) * n_horizontal
+    middle_gaps = vertical_gaps + n_vertical * (n_horizontal - 1)
+
+    index = np.zeros((height, width), dtype=np.int32)
+    index = np.where(
+        square_row & square_column, squares + row * n_horizontal + column, index
+    )
+    index = np.where(
+        gap_row & square_column, horizontal_gaps + row * n_horizontal + column, index
+    )
+    index = np.where(
+        square_row & gap_column,
+        vertical_gaps + row * (n_horizontal - 1) + column,
+        index,
+    )
+    index = np.where(
+        gap_row & gap_column, middle_gaps + row * (n_horizontal - 1) + column, index
+    )
+
+    # The layout is shared between calls, so make sure it isn't modified.
+    index = index.astype(np.int32)
+    index.flags.writeable = False
+    return index
+
+
+def fit_layout(
+    width: int,
+    height: int,
+    gap: int,
+    external_gap: int,
+    square_width: int,
+    square_height: int,
+    resolution: Tuple[int] = (1920, 1080),
+) -> Tuple[int]:
+    """ Fits the gaps and sizes, which are meant for the resolution, to a grid of width x height pixels
+
+    The gaps and sizes are scaled with the resolution, after which the gaps and the squares are adjusted, as little
+    as possible, such that the squares fill out the width and height exactly.
+    Returns the gap, the external gap, the square width and the square height.
+    """
+    scale = np.sqrt(width * height / (resolution[0] * resolution[1]))
+    gap = max(1, round(gap * scale))
+    external_gap = round(external_gap * scale)
+    sizes = (max(1, square_width * scale), max(1, square_height * scale))
+
+    best, best_cost = None, np.inf
+    for g in range(max(1, gap // 2), gap + max(1, gap // 2) + 1):
+        for e in range(0, external_gap + int(max(sizes)) + g + 1):
+            cost = abs(g - gap) / gap + abs(e - external_gap) / (max(sizes) + gap)
+            fitted = []
+            for length, size in zip((width, height), sizes):
+                # The squares and gaps take up n * (square + gap) - gap pixels, hence n must divide the room.
+                room = length - 2 * e + g
+                target = int(room / (size + g))
+                ns = [
+                    n
+                    for n in range(max(1, target - 2), target + 4)
+                    if room % n == 0 and room // n > g
+                ]
+                if not ns:
+                    break
+                n = min(ns, key=lambda n: abs(room // n - g - size))
+                fitted.append(room // n - g)
+                cost += abs(fitted[-1] - size) / size
+            else:
+                if cost < best_cost:
+                    best, best_cost = (g, e, *fitted), cost
+
+    if best is None:
+        raise ValueError(f"Can't fit a grid with a gap of {gap} to {width}x{height}.")
+    return best
+
+
+def main():
+    """Draw a grid of squares, with the gaps and sizes from config.json, chaining the squares of the same color."""
+    parser = argparse.ArgumentParser(description=main.__doc__)
+    parser.add_argument(
+        "--chain",
+        choices=["vertical", "horizontal", "both", "middles"],
+        default="middles",
+        help="chain the squares vertically, horizontally, both or both and fill out the middles",
+    )
+    parser.add_argument("--output", default="grid.png")
+    args = parser.parse_args()
+
+    profiler = Profiler(PROFILE_STAGE, PROFILE_MEMORY)
+    cfg = load_config()
+    with profiler.stage("squares"):
         grid = Grid(
             gap=cfg["internal-gap"],
             external_gap=cfg["external-gap"],
@@ -225,28 +315,25 @@ if __name__ == "__main__":
             width=cfg["width"],
             height=cfg["height"],
         )
-        # chose one:
-        choice = ""
-        while choice not in ["1", "2", "3", "4", "q"]:
-            choice = input(
-                """Please chose an option for connecting squares with the same color:
-                    \n  1. chain squares vertically.
-                    \n  2. chain squares horizontally.
-                    \n  3. chain squares vertically & horizontally.
-                    \n  4. chain squares vertically & horizontally and fill out the middles.
-                    \nChose (1-4), 'q' to quit: """
-            )
-        if choice == "q":
-            exit()
-        elif choice == "1":
+
+    with profiler.stage("chain"):
+        if args.chain == "vertical":
             grid.chain_vertical()
-        elif choice == "2":
+        elif args.chain == "horizontal":
             grid.chain_horizontal()
-        elif choice == "3":
-            grid.chain_squares()
-        elif choice == "4":
-            grid.chain_squares(with_middles=True)
-
-        bitmap = grid.create_image()
-        img = Image.fromarray(bitmap, "RGB")
-        img.show()
+        else:
+            grid.chain_squares(with_middles=args.chain == "middles")
+
+    with profiler.stage("render", pixels=cfg["width"] * cfg["height"]):
+        indices = grid.create_indices()
+    with profiler.stage("save", pixels=cfg["width"] * cfg["height"]):
+        write_png(
+            args.output, cfg["width"], cfg["height"], [indices], palette=grid.palette
+        )
+
+    if PROFILE_REPORT is not None:
+        profiler.save(PROFILE_REPORT)
+
+
+if __name__ == "__main__":
+    main()
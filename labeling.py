@@ -0,0 +1,166 @@
+#!/usr/bin/env python3
+from typing import Tuple
+import numpy as np
+from numpy.typing import ArrayLike
+
+
+def _compress(parent: ArrayLike) -> ArrayLike:
+    """Point every node directly at the root of its tree."""
+    while True:
+        grandparent = parent[parent]
+        if (grandparent == parent).all():
+            return parent
+        parent = grandparent
+
+
+def index_dtype(n: int) -> np.dtype:
+    """Return the smallest of int32 and int64, which can index n elements."""
+    return np.int32 if n < 2**31 else np.int64
+
+
+def connected_components(n: int, a: ArrayLike, b: ArrayLike) -> ArrayLike:
+    """Union find over the nodes 0, ..., n - 1 and the edges (a, b), returns the root of each node.
+
+    Roots are always hooked onto smaller roots, hence the root of a component is its smallest node.
+    """
+    parent = np.arange(n, dtype=index_dtype(n))
+    a, b = np.asarray(a), np.asarray(b)
+    while len(a) > 0:
+        parent = _compress(parent)
+        ra, rb = parent[a], parent[b]
+        different = ra != rb
+        a, b, ra, rb = a[different], b[different], ra[different], rb[different]
+        np.minimum.at(parent, np.maximum(ra, rb), np.minimum(ra, rb))
+
+    return _compress(parent)
+
+
+def label_image(values: ArrayLike) -> Tuple[ArrayLike, ArrayLike]:
+    """Label the 4-connected regions of equal values, numbered in the order they are met scanning the image.
+
+    Returns the label of each pixel and the (flat) index of the first pixel in each region.
+    """
+    height, width = values.shape
+    index = np.arange(height * width, dtype=index_dtype(height * width))
+    index = index.reshape(height, width)
+
+    horizontal = values[:, 1:] == values[:, :-1]
+    vertical = values[1:, :] == values[:-1, :]
+    a = np.concatenate([index[:, :-1][horizontal], index[:-1, :][vertical]])
+    b = np.concatenate([index[:, 1:][horizontal], index[1:, :][vertical]])
+
+    roots = connected_components(height * width, a, b)
+    is_root = roots == np.arange(height * width)
+    labels = (np.cumsum(is_root, dtype=np.int32) - 1)[roots]
+
+    return labels.reshape(height, width), np.flatnonzero(is_root)
+
+
+def label_groups(indices: ArrayLike) -> Tuple[ArrayLike, ArrayLike, ArrayLike]:
+    """Find the groups of pixels with the same color, from the index of the color of each pixel.
+
+    Returns an int32 label image, along with the color index and the size of each label.
+    """
+    labels, first = label_image(indices)
+    colors = indices.ravel()[first]
+    sizes = np.bincount(labels.ravel(), minlength=len(first))
+
+    return labels, colors, sizes
+
+
+class RegionGraph:
+    """The adjacency graph of the regions in a label image.
+
+    Each pair of adjacent regions is stored in both directions, sorted by the source region,
+    along with the length of the border between them (the number of adjacent pixel pairs).
+    """
+
+    def __init__(self, labels: ArrayLike, colors: ArrayLike, sizes: ArrayLike):
+        """Build the graph from a label image, along with the color and the size of each label."""
+        self.colors = np.asarray(colors, dtype=np.int64)
+        self.sizes = np.asarray(sizes)
+
+        horizontal = labels[:, 1:] != labels[:, :-1]
+        vertical = labels[1:, :] != labels[:-1, :]
+        a = np.concatenate([labels[:, :-1][horizontal], labels[:-1, :][vertical]])
+        b = np.concatenate([labels[:, 1:][horizontal], labels[1:, :][vertical]])
+
+        # Count the adjacent pixel pairs of each pair of regions, before storing them in both directions.
+        keys, lengths = np.unique(
+            np.minimum(a, b).astype(np.int64) * len(self) + np.maximum(a, b),
+            return_counts=True,
+        )
+        del a, b
+        a, b = np.divmod(keys, len(self))
+        self._set_edges(
+            np.concatenate([a, b]),
+            np.concatenate([b, a]),
+            np.concatenate([lengths, lengths]),
+        )
+
+    def __len__(self) -> int:
+        """Return the number of regions."""
+        return len(self.sizes)
+
+    def _set_edges(self, sources: ArrayLike, targets: ArrayLike, lengths: ArrayLike):
+        """Store the edges, summing the border lengths of duplicate edges and dropping self loops."""
+        n = len(self)
+        keep = sources != targets
+        keys, inverse = np.unique(
+            sources[keep].astype(np.int64) * n + targets[keep], return_inverse=True
+        )
+        self.sources, self.targets = np.divmod(keys, n)
+        self.lengths = np.bincount(
+            inverse, weights=lengths[keep], minlength=len(keys)
+        ).astype(np.int64)
+        self.offsets = np.searchsorted(self.sources, np.arange(n + 1))
+
+    def neighbours(self, region: int) -> Tuple[ArrayLike, ArrayLike]:
+        """Return the neighbouring regions of the region, along with the lengths of the shared borders."""
+        start, end = self.offsets[region], self.offsets[region + 1]
+        return self.targets[start:end], self.lengths[start:end]
+
+    def neighbour_colors(self) -> Tuple[ArrayLike, ArrayLike, ArrayLike]:
+        """Return the colors adjacent to each region, as (region, color, weight) arrays.
+
+        The weight is the sum of the border length times the size, over the neighbours with that color.
+        """
+        n_colors = int(self.colors.max()) + 1 if len(self) > 0 else 1
+        keys, inverse = np.unique(
+            self.sources * n_colors + self.colors[self.targets], return_inverse=True
+        )
+        weights = np.bincount(
+            inverse,
+            weights=self.lengths * self.sizes[self.targets],
+            minlength=len(keys),
+        )
+        regions, colors = np.divmod(keys, n_colors)
+        return regions, colors, weights
+
+    def recolor(self, regions: ArrayLike, colors: ArrayLike) -> ArrayLike:
+        """Recolor the regions, merging them with the adjacent regions of the same color.
+
+        Only the edges touching the recolored regions are considered for merging, and the graph is
+        updated in place. Returns the mapping from the old regions to the new regions.
+        """
+        recolored = np.zeros(len(self), dtype=bool)
+        recolored[regions] = True
+        self.colors = self.colors.copy()
+        self.colors[regions] = colors
+
+        merge = (recolored[self.sources] | recolored[self.targets]) & (
+            self.colors[self.sources] == self.colors[self.targets]
+        )
+        roots = connected_components(
+            len(self), self.sources[merge], self.targets[merge]
+        )
+        is_root = roots == np.arange(len(self))
+        mapping = (np.cumsum(is_root) - 1)[roots]
+
+        self.sizes = np.bincount(
+            mapping, weights=self.sizes, minlength=is_root.sum()
+        ).astype(np.int64)
+        self.colors = self.colors[is_root]
+        self._set_edges(mapping[self.sources], mapping[self.targets], self.lengths)
+
+        return mapping
@@ -1,60 +1,369 @@
 # NOTE: the color rgb (0, 0, 0) black, dosn't work with this script
 # /usr/bin/env python3
-from config import WIDTH, HEIGHT, COLORS, RATIOS, POINTS_WITH_RANDOM_COLORS
+from config import (
+    WIDTH,
+    HEIGHT,
+    COLORS,
+    RATIOS,
+    POINTS_WITH_RANDOM_COLORS,
+    SEED_SAMPLING,
+    SEED,
+    PROFILE_REPORT,
+    PROFILE_STAGE,
+    PROFILE_MEMORY,
+)
 from canvas import Canvas
+from profiling import Profiler, count
+from sampling import sample_points
 import numpy as np
-from typing import Callable, Dict, Tuple, List
+from typing import Callable, Dict, Tuple
 from numpy.typing import ArrayLike
-from tqdm import tqdm
 
+METRICS: Dict[str, Callable[[ArrayLike, ArrayLike], ArrayLike]] = {
+    # Gives you loads of angles of 45 degrees.
+    "taxicab": lambda dy, dx: np.abs(dy) + np.abs(dx),
+    # Rounder corners.
+    "euclidean": lambda dy, dx: np.sqrt(
+        dy.astype(np.float64) ** 2 + dx.astype(np.float64) ** 2
+    ),
+    "chebyshev": lambda dy, dx: np.maximum(np.abs(dy), np.abs(dx)),
+}
+
+
+class GridIndex:
+    """Bucket the points into a grid of square cells, to answer exact nearest neighbour queries.
+
+    Every metric in METRICS is at least the chebyshev distance, so once the rings of cells around a
+    pixel have been searched, the distance to the cells outside of the rings bounds the remaining points.
+    """
+
+    def __init__(
+        self, points: ArrayLike, height: int, width: int, cell_size: int = None
+    ):
+        """Initialize the index, by default the cells are sized to hold about one point each."""
+        self.points = np.asarray(points, dtype=np.int64).reshape(-1, 2)
+        if len(self.points) == 0:
+            raise ValueError("Expected at least one point.")
+
+        self.cell_size = cell_size or max(
+            1, int(np.sqrt(height * width / len(self.points)))
+        )
+        self.rows = -(-height // self.cell_size)
+        self.columns = -(-width // self.cell_size)
+
+        cells = (self.points[:, 0] // self.cell_size) * self.columns + self.points[
+            :, 1
+        ] // self.cell_size
+        self.order = np.argsort(cells, kind="stable")
+        self.counts = np.bincount(cells, minlength=self.rows * self.columns)
+        self.starts = np.concatenate([[0], np.cumsum(self.counts)[:-1]])
+
+    def query(
+        self, ys: ArrayLike, xs: ArrayLike, metric: str = "euclidean"
+    ) -> Tuple[ArrayLike, ArrayLike]:
+        """Find the index of the nearest point to each pixel, along with the distance to it."""
+        distance = METRICS[metric]
+        ys, xs = np.asarray(ys, dtype=np.int64), np.asarray(xs, dtype=np.int64)
+        nearest = np.full(len(ys), -1, dtype=np.int64)
+        best = np.full(len(ys), np.inf)
+
+        cy, cx = ys // self.cell_size, xs // self.cell_size
+        unresolved = np.arange(len(ys))
+        r = 0
+        while len(unresolved) > 0:
+            ring = [
+                (dy, dx)
+                for dy in range(-r, r + 1)
+                for dx in range(-r, r + 1)
+                if max(abs(dy), abs(dx)) == r
+            ]
+            for dy, dx in ring:
+                y, x = cy[unresolved] + dy, cx[unresolved] + dx
+                inside = (y >= 0) & (y < self.rows) & (x >= 0) & (x < self.columns)
+                pixels = unresolved[inside]
+                cells = y[inside] * self.columns + x[inside]
+                counts, starts = self.counts[cells], self.starts[cells]
+
+                k = 0
+                while len(pixels) > 0:
+                    more = counts > k
+                    pixels, counts, starts = pixels[more], counts[more], starts[more]
+                    candidates = self.order[starts + k]
+                    d = distance(
+                        self.points[candidates, 0] - ys[pixels],
+                        self.points[candidates, 1] - xs[pixels],
+                    )
+                    closer = d < best[pixels]
+                    best[pixels[closer]] = d[closer]
+                    nearest[pixels[closer]] = candidates[closer]
+                    k += 1
 
-# TODO: Maybe take inspiration from barnes hut and create quadrants.
+            # The chebyshev distance to the closest cell outside of the rings searched so far.
+            y, x = ys[unresolved], xs[unresolved]
+            bound = np.minimum(
+                np.minimum(
+                    y - (cy[unresolved] - r) * self.cell_size + 1,
+                    (cy[unresolved] + r + 1) * self.cell_size - y,
+                ),
+                np.minimum(
+                    x - (cx[unresolved] - r) * self.cell_size + 1,
+                    (cx[unresolved] + r + 1) * self.cell_size - x,
+                ),
+            )
+            unresolved = unresolved[best[unresolved] > bound]
+            r += 1
+            if r > max(self.rows, self.columns):
+                break
+
+        return nearest, best
+
+
+def jump_flooding(
+    points: ArrayLike, height: int, width: int, metric: str = "euclidean"
+) -> ArrayLike:
+    """Approximate the index of the nearest point to each pixel, using the jump flooding algorithm."""
+    distance = METRICS[metric]
+    points = np.asarray(points, dtype=np.int64).reshape(-1, 2)
+    nearest = np.full((height, width), -1, dtype=np.int64)
+    nearest[points[:, 0], points[:, 1]] = np.arange(len(points))
+
+    ys, xs = np.mgrid[0:height, 0:width]
+    best = np.full((height, width), np.inf)
+    best[points[:, 0], points[:, 1]] = 0
+
+    steps = [
+        1 << e for e in range(int(np.ceil(np.log2(max(height, width)))) - 1, -1, -1)
+    ]
+    # The extra pass with a step of one, fixes most of the errors made by the algorithm.
+    for step in steps + [1]:
+        for dy in (-step, 0, step):
+            for dx in (-step, 0, step):
+                # The steps can be longer than the short side of the canvas, which has no pixels that far apart.
+                if (dy == 0 and dx == 0) or abs(dy) >= height or abs(dx) >= width:
+                    continue
+                # Candidates are the nearest points of the pixel (y + dy, x + dx).
+                candidates = np.full((height, width), -1, dtype=np.int64)
+                candidates[
+                    max(0, -dy) : height - max(0, dy), max(0, -dx) : width - max(0, dx)
+                ] = nearest[
+                    max(0, dy) : height - max(0, -dy), max(0, dx) : width - max(0, -dx)
+                ]
+                valid = candidates >= 0
+                d = np.full((height, width), np.inf)
+                d[valid] = distance(
+                    points[candidates[valid], 0] - ys[valid],
+                    points[candidates[valid], 1] - xs[valid],
+                )
+                closer = d < best
+                best[closer] = d[closer]
+                nearest[closer] = candidates[closer]
+
+    return nearest
+
+
+# NOTE: Use the jump flooding backend if the number of points is very large, it's approximate however.
 def nearest_neighbour(
     canvas: Canvas,
-    colored_points_and_color: Dict[Tuple[int], Tuple[int]],
-    metric: Callable[ArrayLike, float],
+    points: ArrayLike,
+    colors: ArrayLike,
+    metric: str = "euclidean",
+    backend: str = "grid",
 ) -> Canvas:
-    """Perform the nearest neighbour algorithm."""
-    points = list(colored_points_and_color.keys())
-    for (y0, x0) in tqdm(canvas.pixels()):
-
-        # Find the closest, color
-        distances = [metric((y0 - y, x0 - x)) for (y, x) in points]
-        closest_y, closest_x = points[np.argmin(distances)]
+    """Perform the nearest neighbour algorithm, coloring each pixel with the color of the closest point."""
+    if metric not in METRICS:
+        raise ValueError(f"Expected one of the metrics {list(METRICS)} got {metric}.")
 
-        canvas.set_pixel(y0, x0, canvas.get_color_of_pixel(closest_y, closest_x))
+    if backend == "grid":
+        ys, xs = np.mgrid[0 : canvas.height, 0 : canvas.width]
+        nearest, _ = GridIndex(points, canvas.height, canvas.width).query(
+            ys.ravel(), xs.ravel(), metric
+        )
+        nearest = nearest.reshape(canvas.height, canvas.width)
+    elif backend == "jump-flooding":
+        nearest = jump_flooding(points, canvas.height, canvas.width, metric)
+    else:
+        raise ValueError(
+            f"Expected the backend to be 'grid' or 'jump-flooding' got {backend}."
+        )
 
+    canvas.paint(slice(None), slice(None), np.asarray(colors, dtype="uint8")[nearest])
+    count("points", len(points))
     return canvas
 
 
+class IncrementalVoronoi:
+    """Keep the canvas colored by the nearest point, as the points are moved, added and removed.
+
+    Alongside the canvas the index of the nearest point and the distance to it is kept for every pixel,
+    along with a bounding box of the pixels owned by each point, such that only the pixels near the
+    points which changed are recomputed.
+    """
+
+    def __init__(
+        self,
+        canvas: Canvas,
+        points: ArrayLike,
+        colors: ArrayLike,
+        metric: str = "euclidean",
+    ):
+        """Initialize the diagram, by computing the nearest point of every pixel."""
+        if metric not in METRICS:
+            raise ValueError(
+                f"Expected one of the metrics {list(METRICS)} got {metric}."
+            )
+        self.canvas = canvas
+        self.metric = metric
+        self.points = np.asarray(points, dtype=np.int64).reshape(-1, 2)
+        self.colors = np.asarray(colors, dtype="uint8").reshape(len(self.points), -1)
+        self.alive = np.ones(len(self.points), dtype=bool)
+
+        ys, xs = np.mgrid[0 : canvas.height, 0 : canvas.width]
+        nearest, distances = GridIndex(points, canvas.height, canvas.width).query(
+            ys.ravel(), xs.ravel(), metric
+        )
+        self.nearest = nearest.reshape(canvas.height, canvas.width)
+        self.distances = distances.reshape(canvas.height, canvas.width)
+        canvas.paint(slice(None), slice(None), self.colors[self.nearest])
+
+        self.boxes = np.zeros((len(self.points), 4), dtype=np.int64)
+        self.boxes[:, [0, 2]] = self.points
+        self.boxes[:, [1, 3]] = self.points + 1
+        self._expand_boxes(self.nearest.ravel(), ys.ravel(), xs.ravel())
+
+    def _expand_boxes(self, owners: ArrayLike, ys: ArrayLike, xs: ArrayLike):
+        """Expand the bounding boxes (y0, y1, x0, x1) of the owners to include the pixels."""
+        np.minimum.at(self.boxes[:, 0], owners, ys)
+        np.maximum.at(self.boxes[:, 1], owners, ys + 1)
+        np.minimum.at(self.boxes[:, 2], owners, xs)
+        np.maximum.at(self.boxes[:, 3], owners, xs + 1)
+
+    def _assign(
+        self, ys: ArrayLike, xs: ArrayLike, owners: ArrayLike, distances: ArrayLike
+    ):
+        """Assign the pixels to new owners."""
+        self.nearest[ys, xs] = owners
+        self.distances[ys, xs] = distances
+        self.canvas.paint(ys, xs, self.colors[owners])
+        self._expand_boxes(owners, ys, xs)
+
+    def _reassign(self, changed: ArrayLike) -> int:
+        """Find new owners for the pixels owned by the changed points, using the current positions."""
+        ids = np.flatnonzero(self.alive)
+        index = GridIndex(self.points[ids], self.canvas.height, self.canvas.width)
+
+        count = 0
+        for i in changed:
+            y0, y1, x0, x1 = self.boxes[i]
+            ys, xs = np.nonzero(self.nearest[y0:y1, x0:x1] == i)
+            ys, xs = ys + y0, xs + x0
+            nearest, distances = index.query(ys, xs, self.metric)
+            self._assign(ys, xs, ids[nearest], distances)
+            count += len(ys)
+
+            # Recompute the bounding box, now that the owned pixels are known exactly.
+            if self.alive[i]:
+                ys, xs = np.nonzero(self.nearest[y0:y1, x0:x1] == i)
+                ys = np.append(ys + y0, self.points[i, 0])
+                xs = np.append(xs + x0, self.points[i, 1])
+                self.boxes[i] = [ys.min(), ys.max() + 1, xs.min(), xs.max() + 1]
+
+        return count
+
+    def _claim(self, i: int) -> int:
+        """Let the point claim the pixels which are closer to it than to their current owner.
+
+        The distance to the nearest point is 1-Lipschitz, so if a pixel outside of the box searched is
+        claimed, the segment towards it crosses the edge of the box at a point which is also claimed.
+        That point is within half a pixel of a pixel on the edge, hence the box is grown until no pixels
+        on its edge are within a distance of one from being claimed.
+        """
+        distance = METRICS[self.metric]
+        (py, px), height, width = self.points[i], self.canvas.height, self.canvas.width
+        r = 2
+        while True:
+            y0, y1 = max(py - r, 0), min(py + r + 1, height)
+            x0, x1 = max(px - r, 0), min(px + r + 1, width)
+            ys, xs = np.mgrid[y0:y1, x0:x1]
+            distances = distance(ys - py, xs - px)
+            current = self.distances[y0:y1, x0:x1]
+
+            edge = np.zeros(distances.shape, dtype=bool)
+            edge[0] |= y0 > 0
+            edge[-1] |= y1 < height
+            edge[:, 0] |= x0 > 0
+            edge[:, -1] |= x1 < width
+            if not (edge & (distances < current + 1)).any():
+                break
+            r *= 2
+
+        claimed = distances < current
+        claimed[py - y0, px - x0] = True
+        self._assign(
+            ys[claimed], xs[claimed], np.full(claimed.sum(), i), distances[claimed]
+        )
+        return int(claimed.sum())
+
+    def move(self, ids: ArrayLike, positions: ArrayLike) -> int:
+        """Move the points to the new positions, returns the number of pixels recomputed."""
+        ids = np.atleast_1d(ids)
+        self.points[ids] = np.asarray(positions, dtype=np.int64).reshape(-1, 2)
+        count = self._reassign(ids)
+        return count + sum(self._claim(i) for i in ids)
+
+    def add(self, points: ArrayLike, colors: ArrayLike) -> ArrayLike:
+        """Add new points with the given colors, returns the ids of the new points."""
+        points = np.asarray(points, dtype=np.int64).reshape(-1, 2)
+        ids = np.arange(len(self.points), len(self.points) + len(points))
+        self.points = np.vstack([self.points, points])
+        self.colors = np.vstack(
+            [self.colors, np.asarray(colors, dtype="uint8").reshape(len(points), -1)]
+        )
+        self.alive = np.concatenate([self.alive, np.ones(len(points), dtype=bool)])
+        self.boxes = np.vstack(
+            [
+                self.boxes,
+                np.column_stack(
+                    [points[:, 0], points[:, 0] + 1, points[:, 1], points[:, 1] + 1]
+                ),
+            ]
+        )
+        for i in ids:
+            self._claim(i)
+
+        return ids
+
+    def remove(self, ids: ArrayLike) -> int:
+        """Remove the points, returns the number of pixels recomputed."""
+        ids = np.atleast_1d(ids)
+        if self.alive.sum() <= len(np.unique(ids)):
+            raise ValueError("Can't remove every point.")
+        self.alive[ids] = False
+        return self._reassign(ids)
+
+
 def main():
     """Run the script."""
+    profiler = Profiler(PROFILE_STAGE, PROFILE_MEMORY)
     canvas = Canvas(WIDTH, HEIGHT)
-    # Color random points
-
-    total = sum(RATIOS)
-    color_weights = [ratio / total for ratio in RATIOS]
-    for _ in range(POINTS_WITH_RANDOM_COLORS):
-        y, x = np.random.randint(0, HEIGHT - 1), np.random.randint(0, WIDTH - 1)
-        color = COLORS[np.random.choice(range(0, len(COLORS)), p=color_weights)]
-
-        canvas.set_pixel(y, x, color)
 
-    # Figure out what points are colored.
-    colored_points_and_colors = {}
-    for (y, x) in canvas.pixels():
-        if all(canvas.get_color_of_pixel(y, x) == (0, 0, 0)):
-            continue
-        else:
-            colored_points_and_colors[(y, x)] = canvas.get_color_of_pixel(y, x)
+    with profiler.stage("seeds"):
+        points, colors = sample_points(
+            SEED_SAMPLING,
+            WIDTH,
+            HEIGHT,
+            POINTS_WITH_RANDOM_COLORS,
+            COLORS,
+            RATIOS,
+            rng=SEED,
+        )
 
-    # Gives you loads of angles of 45 degrees.
-    taxicab = lambda vec: sum(map(abs, vec))
-    # Rounder corners.
-    euclidian = lambda vec: np.sqrt(sum(map(lambda x: x ** 2, vec)))
+    with profiler.stage("nearest-neighbour", pixels=WIDTH * HEIGHT):
+        canvas = nearest_neighbour(canvas, points, colors, "euclidean")
+    with profiler.stage("save", pixels=WIDTH * HEIGHT):
+        canvas.save("nearest_neighbour.jpeg")
 
-    canvas = nearest_neighbour(canvas, colored_points_and_colors, euclidian)
-    canvas.save("nearest_neighbour.jpeg")
+    if PROFILE_REPORT is not None:
+        profiler.save(PROFILE_REPORT)
 
 
 if __name__ == "__main__":
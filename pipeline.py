@@ -0,0 +1,107 @@
+#!/usr/bin/env python3
+from typing import Any, Callable, Dict, List
+from dataclasses import dataclass
+import hashlib
+import json
+import os
+import numpy as np
+from canvas import Canvas, row_bands
+from profiling import Profiler
+from config import CHECKPOINT_DIRECTORY
+
+
+@dataclass()
+class Stage:
+    """A stage of a pipeline, which transforms the canvas based on its parameters."""
+
+    name: str
+    parameters: Dict[str, Any]
+    run: Callable[[Canvas], Canvas]
+
+
+def stage_keys(stages: List[Stage]) -> List[str]:
+    """Hash the parameters of each stage, along with the key of the previous stage.
+
+    Hence the key of a stage changes, whenever the parameters of the stage or any of the stages before it change.
+    """
+    keys, previous = [], ""
+    for stage in stages:
+        text = json.dumps([stage.name, stage.parameters, previous], sort_keys=True)
+        previous = hashlib.sha256(text.encode()).hexdigest()
+        keys.append(previous)
+
+    return keys
+
+
+def checkpoint_path(directory: str, i: int, stage: Stage) -> str:
+    """Return the path of the checkpoint of the stage, without the extension."""
+    return os.path.join(directory, f"{i}-{stage.name}")
+
+
+def is_fresh(path: str, key: str) -> bool:
+    """Check if the checkpoint exists and was made with the given key."""
+    try:
+        with open(f"{path}.json", "r") as file:
+            return json.load(file)["key"] == key and os.path.exists(f"{path}.npy")
+    except (FileNotFoundError, ValueError, KeyError):
+        return False
+
+
+def save_checkpoint(path: str, key: str, stage: Stage, canvas: Canvas):
+    """Save the canvas as a .npy file, along with the parameters of the stage."""
+    # The .npy file is written before the .json file, hence a partially written checkpoint is never fresh.
+    # The canvas is copied a band of rows at a time, as it may be larger than the memory.
+    tensor = np.lib.format.open_memmap(
+        f"{path}.npy.tmp",
+        mode="w+",
+        dtype="uint8",
+        shape=(canvas.height, canvas.width, 3 if canvas.is_rgb else 1),
+    )
+    for rows in row_bands(canvas.height):
+        tensor[rows] = canvas.get_rows(rows.start, rows.stop)
+    tensor.flush()
+    del tensor
+    os.replace(f"{path}.npy.tmp", f"{path}.npy")
+    with open(f"{path}.json", "w") as file:
+        json.dump({"key": key, "parameters": stage.parameters}, file, indent=4)
+
+
+def run_pipeline(
+    canvas: Canvas,
+    stages: List[Stage],
+    directory: str = CHECKPOINT_DIRECTORY,
+    verbose: bool = True,
+    profiler: Profiler = None,
+) -> Canvas:
+    """Run the stages in order, checkpointing the canvas after each stage.
+
+    The stages up to the first stage, whose parameters (or the parameters before it) has changed, are
+    loaded from their checkpoints rather than being run again.
+    """
+    profiler = Profiler() if profiler is None else profiler
+    pixels = canvas.width * canvas.height
+    os.makedirs(directory, exist_ok=True)
+    keys = stage_keys(stages)
+    paths = [checkpoint_path(directory, i, stage) for i, stage in enumerate(stages)]
+
+    fresh = 0
+    while fresh < len(stages) and is_fresh(paths[fresh], keys[fresh]):
+        fresh += 1
+
+    if fresh > 0:
+        if verbose:
+            print(f"loading {stages[fresh - 1].name} from {paths[fresh - 1]}.npy")
+        with profiler.stage(f"load-{stages[fresh - 1].name}", pixels):
+            tensor = np.load(f"{paths[fresh - 1]}.npy", mmap_mode="r")
+            for rows in row_bands(canvas.height):
+                canvas.paint(rows, slice(None), tensor[rows])
+
+    for stage, key, path in zip(stages[fresh:], keys[fresh:], paths[fresh:]):
+        if verbose:
+            print(f"running {stage.name}.")
+        with profiler.stage(stage.name, pixels):
+            canvas = stage.run(canvas)
+        with profiler.stage(f"checkpoint-{stage.name}", pixels):
+            save_checkpoint(path, key, stage, canvas)
+
+    return canvas
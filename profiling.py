@@ -0,0 +1,115 @@
+#!/usr/bin/env python3
+from typing import Any, Dict, Iterator, List
+from contextlib import contextmanager
+from time import perf_counter
+import cProfile
+import json
+import os
+import tracemalloc
+
+try:
+    import resource
+except ImportError:  # Not available on windows.
+    resource = None
+
+# The counters of the stages being profiled, the innermost stage last.
+_counters: List[Dict[str, float]] = []
+
+
+def count(name: str, value: float = 1):
+    """Add to a counter of the stage being profiled, this does nothing if no stage is being profiled."""
+    if _counters:
+        _counters[-1][name] = _counters[-1].get(name, 0) + value
+
+
+def peak_rss() -> int:
+    """Return the peak resident set size of the process in bytes, or None if it's unknown."""
+    if resource is None:
+        return None
+    # NOTE: ru_maxrss is in kilobytes on linux.
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+def current_rss() -> int:
+    """Return the current resident set size of the process in bytes, or None if it's unknown."""
+    try:
+        with open("/proc/self/statm", "r") as file:  # Only available on linux.
+            return int(file.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, IndexError):
+        return None
+
+
+class Profiler:
+    """Record the wall time, the memory usage and the counters of each stage of a script."""
+
+    def __init__(self, profile_stage: str = None, trace_memory: bool = False):
+        """Initialize the profiler, the stage with the given name is profiled with cProfile.
+
+        Tracing the memory allocations with tracemalloc slows down the stages, so it's disabled by default.
+        """
+        self.profile_stage = profile_stage
+        self.trace_memory = trace_memory
+        self.stages = []
+        self.start = perf_counter()
+
+    @contextmanager
+    def stage(self, name: str, pixels: int = None) -> Iterator[Dict[str, float]]:
+        """Profile the code in the with block as a stage, yields the counters of the stage.
+
+        The rates are computed for the number of pixels, and the "steps" counter if it's used.
+        """
+        counters = {}
+        if self.trace_memory:
+            if not tracemalloc.is_tracing():
+                tracemalloc.start()
+            tracemalloc.reset_peak()
+            traced = tracemalloc.get_traced_memory()[0]
+        profile = cProfile.Profile() if name == self.profile_stage else None
+
+        _counters.append(counters)
+        rss = current_rss()
+        start = perf_counter()
+        if profile is not None:
+            profile.enable()
+        try:
+            yield counters
+        finally:
+            if profile is not None:
+                profile.disable()
+                profile.dump_stats(f"{name}.prof")
+            wall_time = perf_counter() - start
+            _counters.pop()
+
+            # The peak is of the whole process, hence it's the same for every stage after the one which reached it,
+            # the growth of the resident set size is specific to the stage.
+            record = {
+                "name": name,
+                "wall_time": wall_time,
+                "rss_growth": None if rss is None else current_rss() - rss,
+                "process_peak_rss": peak_rss(),
+            }
+            if pixels is not None:
+                record["pixels"] = pixels
+                record["pixels_per_second"] = pixels / max(wall_time, 1e-9)
+            if "steps" in counters:
+                record["steps_per_second"] = counters["steps"] / max(wall_time, 1e-9)
+            if self.trace_memory:
+                current, peak = tracemalloc.get_traced_memory()
+                record["allocated"] = current - traced
+                record["peak_allocated"] = peak - traced
+            record["counters"] = counters
+            self.stages.append(record)
+
+    def report(self) -> Dict[str, Any]:
+        """Return the report of the stages profiled so far."""
+        return {
+            "wall_time": perf_counter() - self.start,
+            "peak_rss": peak_rss(),
+            "stages": self.stages,
+        }
+
+    def save(self, file_path: str):
+        """Save the report as json."""
+        with open(file_path, "w") as file:
+            # The counters may be numpy scalars.
+            json.dump(self.report(), file, indent=4, default=lambda value: value.item())
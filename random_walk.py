@@ -1,12 +1,15 @@
 #!/usr/bin/env python3
-from typing import Tuple, List, Iterable, Dict
+from typing import Callable, Tuple, List, Iterable
 from dataclasses import dataclass
 import numpy as np
-import random
 from numpy.typing import ArrayLike
 from tqdm import trange, tqdm
-from copy import deepcopy
-from canvas import Canvas, adjecent_pixels, scale_up_by
+from multiprocessing import Pool, shared_memory
+from canvas import Canvas, IndexedCanvas, save_scaled, row_bands
+from encoder import BackgroundEncoder
+from labeling import label_groups, RegionGraph
+from pipeline import Stage, run_pipeline
+from profiling import Profiler, count
 from config import (
     COLORS,
     RATIOS,
@@ -14,14 +17,29 @@ from config import (
     HEIGHT,
     PROBABILITY_FOR_COLOR_TO_STAY_THE_SAME,
     NUMBER_OF_STEPS,
+    NUMBER_OF_WALKERS,
+    TARGET_COVERAGE,
+    NUMBER_OF_PROCESSES,
+    TILE_OVERLAP,
+    BAND_ROWS,
+    CANVAS_FILE,
+    INDEXED_CANVAS,
     SCALE,
     PASSES_REMOVING_NOISE,
+    CUTOF,
+    NOISE_REMOVAL,
+    MAJORITY_KERNEL_SIZE,
+    SEED,
+    PROFILE_REPORT,
+    PROFILE_STAGE,
+    PROFILE_MEMORY,
 )
 
 
-def random_walk(canvas: Canvas) -> Canvas:
+def random_walk(canvas: Canvas, rng: np.random.Generator = None) -> Canvas:
     """Perform a random walk on the canvas."""
-    pos = [np.random.randint(0, canvas.height), np.random.randint(0, canvas.width)]
+    rng = np.random.default_rng(rng)
+    pos = [rng.integers(0, canvas.height), rng.integers(0, canvas.width)]
     color = list(COLORS[0])
     total = sum(RATIOS)
     weights = [ratio / total for ratio in RATIOS]
@@ -30,11 +48,11 @@ def random_walk(canvas: Canvas) -> Canvas:
         canvas.set_pixel(pos[0], pos[1], color)
 
         # Update position and color
-        pos[np.random.randint(0, len(pos))] += 1 if np.random.rand() > 0.5 else -1
+        pos[rng.integers(0, len(pos))] += 1 if rng.random() > 0.5 else -1
 
-        if np.random.rand() > PROBABILITY_FOR_COLOR_TO_STAY_THE_SAME:
+        if rng.random() > PROBABILITY_FOR_COLOR_TO_STAY_THE_SAME:
             # Pick a new color according to the ratios
-            color = list(COLORS[np.random.choice(range(0, len(COLORS)), p=weights)])
+            color = list(COLORS[rng.choice(range(0, len(COLORS)), p=weights)])
 
         # Boundary checks
         constrain = lambda x, M, m: x if x >= m and x < M else (M if x < M else m)
@@ -44,172 +62,1209 @@ def random_walk(canvas: Canvas) -> Canvas:
     return canvas
 
 
-# NOTE: I dont think this needs to be recursive (it scans from top to bottom, left to right.)
-def remove_black_pixels(canvas: Canvas, depth: int = 0, max_depth: int = 6) -> Canvas:
-    """Remove the black colored pixels, by replacing them with the color adjecent to them."""
-    if depth == max_depth:
-        return canvas
+def constrain(values: ArrayLike, upper: ArrayLike) -> ArrayLike:
+    """Vectorized version of the boundary check used in random_walk."""
+    return np.where(values < 0, upper, np.where(values >= upper, 0, values))
 
-    count = 0
-    for (y0, x0) in canvas.pixels():
-        if all(canvas.get_color_of_pixel(y0, x0) == np.zeros(3, dtype="uint8")):
 
-            # Pick the color of the neighbours, randomly but with probability proprotional to the ratio.
-            neighbour_colors = [
-                tuple(canvas.get_color_of_pixel(y, x))
-                for (y, x) in adjecent_pixels(y0, x0)
-            ]
-            color_ratios = {
-                color: neighbour_colors.count(color)
-                for color in {tuple(c) for c in neighbour_colors}
-                if sum(color) != 0
-            }
+def walk_positions(
+    pos: ArrayLike, axes: ArrayLike, signs: ArrayLike, height: int, width: int
+) -> Tuple[ArrayLike, ArrayLike]:
+    """Resolve the positions painted by a walk, and the position it ends up at.
+
+    The unconstrained path is computed with a cumulative sum, up until the first
+    step which leaves the canvas, where the boundary check is applied before continuing.
+    """
+    n = len(axes)
+    steps = np.zeros((n, 2), dtype=np.int64)
+    steps[np.arange(n), axes] = signs
+    upper = np.array([height - 1, width - 1])
+    pos = np.array(pos, dtype=np.int64)
+
+    painted = np.empty((n, 2), dtype=np.int64)
+    i, window = 0, 64
+    while i < n:
+        if (pos >= upper).any():
+            # The boundary check lets the walker sit on the last row / column for a single step.
+            painted[i] = pos
+            pos = constrain(pos + steps[i], upper)
+            i += 1
+            continue
+
+        path = pos + np.cumsum(steps[i : i + window], axis=0)
+        outside = ((path < 0) | (path >= upper)).any(axis=1)
+        if outside.any():
+            k = int(np.argmax(outside))
+            painted[i] = pos
+            painted[i + 1 : i + k + 1] = path[:k]
+            pos = constrain(path[k], upper)
+            i += k + 1
+            window = 64
+        else:
+            painted[i] = pos
+            painted[i + 1 : i + len(path)] = path[:-1]
+            pos = path[-1]
+            i += len(path)
+            window = min(2 * window, 1 << 16)
+
+    return painted, pos
 
-            colors = list(color_ratios.keys())
-            if (
-                len(colors) == 0
-            ):  # If there are nothing but black, skip this pixel for now
-                continue
-            total = sum(color_ratios.values())
-            weights = [ratio / total for ratio in color_ratios.values()]
 
-            color = list(colors[np.random.choice(range(0, len(colors)), p=weights)])
-            canvas.set_pixel(y0, x0, color)
-            count += 1
+def chunked_random_walk(
+    canvas: Canvas,
+    number_of_steps: int = NUMBER_OF_STEPS,
+    chunk_size: int = 1 << 20,
+    verbose: bool = True,
+    colors: List[Tuple[int]] = COLORS,
+    ratios: List[int] = RATIOS,
+    rng: np.random.Generator = None,
+) -> Canvas:
+    """Perform the random walk from random_walk, drawing the steps in large chunks."""
+    rng = np.random.default_rng(rng)
+    pos = np.array([rng.integers(0, canvas.height), rng.integers(0, canvas.width)])
+    color = 0
+    palette = np.array(colors, dtype="uint8")
+    total = sum(ratios)
+    weights = [ratio / total for ratio in ratios]
+
+    # The step at which each pixel was last painted, used to resolve pixels painted multiple times in a chunk.
+    last_painted = np.full(canvas.height * canvas.width, -1, dtype=np.int64)
+
+    with tqdm(total=number_of_steps, disable=not verbose) as progress_bar:
+        for start in range(0, number_of_steps, chunk_size):
+            n = min(chunk_size, number_of_steps - start)
+            axes = rng.integers(0, 2, size=n)
+            signs = np.where(rng.random(n) > 0.5, 1, -1)
+            switches = rng.random(n) > PROBABILITY_FOR_COLOR_TO_STAY_THE_SAME
+            new_colors = rng.choice(
+                len(palette), size=np.count_nonzero(switches), p=weights
+            )
+
+            # The color changes after the pixel has been painted, so it applies from the next step.
+            color_sequence = np.concatenate([[color], new_colors])
+            step_colors = color_sequence[
+                np.concatenate([[0], np.cumsum(switches[:-1])])
+            ]
+            color = color_sequence[-1]
+
+            painted, pos = walk_positions(pos, axes, signs, canvas.height, canvas.width)
+            flat = painted[:, 0] * canvas.width + painted[:, 1]
+            step = np.arange(start, start + n)
+            np.maximum.at(last_painted, flat, step)
+            last = last_painted[flat] == step
+            canvas.paint(painted[last, 0], painted[last, 1], palette[step_colors[last]])
 
-    if count == 0:  # No need to go further.
-        return canvas
+            progress_bar.update(n)
+            count("steps", n)
 
-    return remove_black_pixels(canvas, depth=depth + 1, max_depth=max_depth)
+    return canvas
 
 
 @dataclass()
+class Frame:
+    """A frame of the walk, the canvas after a number of steps, along with the pixels painted since the last frame.
+
+    NOTE: The canvas isn't copied, hence a frame is only valid until the walk continues.
+    """
+
+    canvas: Canvas
+    pixels: ArrayLike  # The flat indices of the painted pixels.
+    steps: int
+
+    def bounding_box(self) -> Tuple[int]:
+        """Return the rows and the columns (y0, y1, x0, x1) of the smallest box containing the painted pixels."""
+        ys, xs = np.divmod(self.pixels, self.canvas.width)
+        if len(ys) == 0:
+            return (0, 0, 0, 0)
+        return (int(ys.min()), int(ys.max()) + 1, int(xs.min()), int(xs.max()) + 1)
+
+    def delta(self) -> Tuple[int, int, ArrayLike, ArrayLike]:
+        """Return the top left corner of the bounding box, the image within it and a mask of the painted pixels.
+
+        The image is the palette indices of the pixels for an IndexedCanvas, and their rgb values otherwise.
+        """
+        y0, y1, x0, x1 = self.bounding_box()
+        if isinstance(self.canvas, IndexedCanvas):
+            image = self.canvas.indices[y0:y1, x0:x1].copy()
+        else:
+            image = self.canvas.tensor[y0:y1, x0:x1].copy()
+        ys, xs = np.divmod(self.pixels, self.canvas.width)
+        mask = np.zeros((y1 - y0, x1 - x0), dtype=bool)
+        mask[ys - y0, xs - x0] = True
+        return y0, x0, image, mask
+
+
+def walk_frames(
+    canvas: Canvas,
+    steps_per_frame: int = 1 << 16,
+    number_of_walkers: int = NUMBER_OF_WALKERS,
+    target_coverage: float = TARGET_COVERAGE,
+    number_of_steps: int = NUMBER_OF_STEPS,
+    verbose: bool = True,
+    colors: List[Tuple[int]] = COLORS,
+    ratios: List[int] = RATIOS,
+    rng: np.random.Generator = None,
+    region: Tuple[int] = None,
+) -> Iterable[Frame]:
+    """Perform the walk of multi_walker_random_walk, yielding a frame every steps_per_frame steps.
+
+    The steps are taken in lockstep by the walkers, hence steps_per_frame is rounded down to a multiple of the
+    number of walkers. Only the pixels within the region (y0, y1, x0, x1), by default the whole canvas, count
+    towards the target coverage.
+    """
+    rng = np.random.default_rng(rng)
+    k = number_of_walkers
+    block_size = max(1, steps_per_frame // k)
+    positions = np.column_stack(
+        [
+            rng.integers(0, canvas.height, size=k),
+            rng.integers(0, canvas.width, size=k),
+        ]
+    )
+    palette = np.array(colors, dtype="uint8")
+    total = sum(ratios)
+    weights = [ratio / total for ratio in ratios]
+    colors = rng.choice(len(palette), size=k, p=weights)
+
+    upper = np.array([canvas.height - 1, canvas.width - 1])
+    walkers = np.arange(k)
+    # A bit per pixel, marking the pixels which has been painted, so the canvas itself is never read.
+    painted = np.zeros((canvas.height * canvas.width + 7) // 8, dtype=np.uint8)
+    y0, y1, x0, x1 = (0, canvas.height, 0, canvas.width) if region is None else region
+    coverage, target = 0, int(np.ceil(target_coverage * (y1 - y0) * (x1 - x0)))
+
+    with tqdm(total=target, disable=not verbose) as progress_bar:
+        for start in range(0, number_of_steps // k, block_size):
+            n = min(block_size, number_of_steps // k - start)
+            axes = rng.integers(0, 2, size=(n, k))
+            signs = np.where(rng.random((n, k)) > 0.5, 1, -1)
+            switches = rng.random((n, k)) > PROBABILITY_FOR_COLOR_TO_STAY_THE_SAME
+            new_colors = rng.choice(len(palette), size=(n, k), p=weights)
+
+            steps = np.zeros((n, k, 2), dtype=np.int64)
+            steps[np.arange(n)[:, None], walkers, axes] = signs
+            # The boundary check of constrain, applied in place, as the loop is bound by the overhead per step.
+            visited = np.empty((n + 1, k, 2), dtype=np.int64)
+            visited[0] = positions
+            for t in range(n):
+                position = visited[t + 1]
+                np.add(visited[t], steps[t], out=position)
+                below = position < 0
+                np.copyto(position, 0, where=position >= upper)
+                np.copyto(position, upper, where=below)
+            positions, visited = visited[-1], visited[:-1]
+
+            # Each walker keeps its color, until the step after it switches.
+            last_switch = np.maximum.accumulate(
+                np.where(switches, np.arange(n)[:, None], -1), axis=0
+            )
+            previous_switch = np.vstack([np.full((1, k), -1), last_switch[:-1]])
+            step_colors = np.where(
+                previous_switch >= 0,
+                new_colors[np.maximum(previous_switch, 0), walkers],
+                colors,
+            )
+            colors = np.where(
+                last_switch[-1] >= 0,
+                new_colors[np.maximum(last_switch[-1], 0), walkers],
+                colors,
+            )
+
+            # Only the last visit to each pixel in the block is painted, sorting the visits by the pixel
+            # and then the step, the last visit to a pixel is the one before the next pixel.
+            flat = (visited[:, :, 0] * canvas.width + visited[:, :, 1]).ravel()
+            keys = np.sort(flat * len(flat) + np.arange(len(flat)))
+            pixels = keys // len(flat)
+            is_last = np.append(pixels[1:] != pixels[:-1], True)
+            pixels, last = pixels[is_last], keys[is_last] % len(flat)
+            canvas.paint(
+                visited[:, :, 0].ravel()[last],
+                visited[:, :, 1].ravel()[last],
+                palette[step_colors.ravel()[last]],
+            )
+
+            bits = np.left_shift(1, pixels & 7).astype(np.uint8)
+            new = (painted[pixels >> 3] & bits) == 0
+            newly_painted = pixels[new]
+            np.bitwise_or.at(painted, newly_painted >> 3, bits[new])
+            ys, xs = np.divmod(newly_painted, canvas.width)
+            covered = np.count_nonzero((ys >= y0) & (ys < y1) & (xs >= x0) & (xs < x1))
+            coverage += covered
+            count("steps", n * k)
+            count("pixels_painted", len(newly_painted))
+            progress_bar.update(min(covered, target - progress_bar.n))
+            yield Frame(canvas, pixels, (start + n) * k)
+            if coverage >= target:
+                break
+
+
+def multi_walker_random_walk(
+    canvas: Canvas,
+    number_of_walkers: int = NUMBER_OF_WALKERS,
+    target_coverage: float = TARGET_COVERAGE,
+    number_of_steps: int = NUMBER_OF_STEPS,
+    block_size: int = 256,
+    verbose: bool = True,
+    colors: List[Tuple[int]] = COLORS,
+    ratios: List[int] = RATIOS,
+    rng: np.random.Generator = None,
+    region: Tuple[int] = None,
+) -> Canvas:
+    """Perform a random walk with several walkers moving in lockstep, until enough of the canvas (or the region
+    (y0, y1, x0, x1) of it) is painted."""
+    for _ in walk_frames(
+        canvas,
+        block_size * number_of_walkers,
+        number_of_walkers,
+        target_coverage,
+        number_of_steps,
+        verbose,
+        colors,
+        ratios,
+        rng,
+        region,
+    ):
+        pass
+
+    return canvas
+
+
+def _walk_tile(
+    shape: Tuple[int],
+    tile: Tuple[int],
+    core: Tuple[int],
+    number_of_walkers: int,
+    target_coverage: float,
+    number_of_steps: int,
+    seed: int,
+    colors: List[Tuple[int]],
+    ratios: List[int],
+) -> Tuple[ArrayLike, ArrayLike]:
+    """Walk a single tile, used by the workers of tiled_random_walk, until enough of its core is painted.
+
+    Returns the tile, along with the mask of the pixels which are painted over the pixels of the neighbouring tiles.
+    """
+    rng = np.random.default_rng(seed)
+    y0, y1, x0, x1 = tile
+    cy0, cy1, cx0, cx1 = core
+    canvas = multi_walker_random_walk(
+        Canvas(x1 - x0, y1 - y0),
+        number_of_walkers=number_of_walkers,
+        target_coverage=target_coverage,
+        number_of_steps=number_of_steps,
+        verbose=False,
+        colors=colors,
+        ratios=ratios,
+        rng=rng,
+        region=(cy0 - y0, cy1 - y0, cx0 - x0, cx1 - x0),
+    )
+
+    # The distance into the core of the tile, ignoring the edges of the canvas, which isn't shared with other tiles.
+    ys, xs = np.arange(y0, y1)[:, None], np.arange(x0, x1)[None, :]
+    far = max(shape[0], shape[1])
+    inside = np.minimum(
+        np.minimum(
+            ys - cy0 + 1 if cy0 > 0 else far, cy1 - ys if cy1 < shape[0] else far
+        ),
+        np.minimum(
+            xs - cx0 + 1 if cx0 > 0 else far, cx1 - xs if cx1 < shape[1] else far
+        ),
+    )
+    overlap = max(cy0 - y0, y1 - cy1, cx0 - x0, x1 - cx1, 1)
+    weights = np.clip((inside + overlap) / (2 * overlap + 1), 0, 1)
+
+    # Pixels painted by the neighbours are painted over with a probability which increases from the
+    # outer edge of the overlap to the inner edge, blending the tiles together across the overlap.
+    return canvas.tensor, rng.random(weights.shape) < weights
+
+
+def tile_grid(height: int, width: int, number_of_tiles: int) -> Tuple[int]:
+    """Return the rows and columns of a grid of number_of_tiles tiles, with the tiles as close to square as possible."""
+    pairs = [
+        (rows, number_of_tiles // rows)
+        for rows in range(1, number_of_tiles + 1)
+        if number_of_tiles % rows == 0
+    ]
+    return min(
+        pairs, key=lambda pair: abs(np.log((height / pair[0]) / (width / pair[1])))
+    )
+
+
+def tiled_random_walk(
+    canvas: Canvas,
+    number_of_processes: int = NUMBER_OF_PROCESSES,
+    number_of_walkers: int = NUMBER_OF_WALKERS,
+    target_coverage: float = TARGET_COVERAGE,
+    number_of_steps: int = NUMBER_OF_STEPS,
+    tiles: Tuple[int] = None,
+    overlap: int = TILE_OVERLAP,
+    colors: List[Tuple[int]] = COLORS,
+    ratios: List[int] = RATIOS,
+    rng: np.random.Generator = None,
+) -> Canvas:
+    """Split the canvas into overlapping tiles, a tile per process by default, which are walked in parallel.
+
+    Each tile gets a share of the walkers and the steps, proportional to the share of the canvas in its core
+    (the tile without the overlap), and walks until target_coverage of its core is painted. The tiles are then
+    painted onto the canvas in order, blending each tile with the tiles before it across the overlap.
+    """
+    rng = np.random.default_rng(rng)
+    if tiles is None:
+        tiles = tile_grid(canvas.height, canvas.width, number_of_processes)
+    rows = np.linspace(0, canvas.height, tiles[0] + 1, dtype=int)
+    columns = np.linspace(0, canvas.width, tiles[1] + 1, dtype=int)
+    overlap = min(
+        overlap, int(np.diff(rows).min()) // 2, int(np.diff(columns).min()) // 2
+    )
+
+    seeds = np.random.SeedSequence(rng.integers(1 << 63)).spawn(tiles[0] * tiles[1])
+    shape = (canvas.height, canvas.width)
+    jobs = []
+    for i in range(tiles[0]):
+        for j in range(tiles[1]):
+            core = (rows[i], rows[i + 1], columns[j], columns[j + 1])
+            tile = (
+                max(rows[i] - overlap, 0),
+                min(rows[i + 1] + overlap, canvas.height),
+                max(columns[j] - overlap, 0),
+                min(columns[j + 1] + overlap, canvas.width),
+            )
+            fraction = (core[1] - core[0]) * (core[3] - core[2]) / (shape[0] * shape[1])
+            jobs.append(
+                (
+                    shape,
+                    tile,
+                    core,
+                    max(1, round(number_of_walkers * fraction)),
+                    target_coverage,
+                    int(number_of_steps * fraction),
+                    int(seeds[i * tiles[1] + j].generate_state(1)[0]),
+                    colors,
+                    ratios,
+                )
+            )
+
+    with Pool(number_of_processes) as pool:
+        results = pool.starmap(_walk_tile, jobs)
+
+    tensor = canvas.tensor.copy()
+    for (_, (y0, y1, x0, x1), *_), (walked, over) in zip(jobs, results):
+        painted_over = tensor[y0:y1, x0:x1]
+        mask = walked.any(axis=-1) & (~painted_over.any(axis=-1) | over)
+        painted_over[mask] = walked[mask]
+    ys, xs = np.nonzero(tensor.any(axis=-1))
+    canvas.paint(ys, xs, tensor[ys, xs])
+
+    return canvas
+
+
+def remove_black_pixels_indices(
+    indices: ArrayLike, is_black: ArrayLike, rng: np.random.Generator = None
+) -> ArrayLike:
+    """Replace the black pixels of an index image with the colors adjecent to them, see remove_black_pixels.
+
+    Black pixels which can't be reached from a painted pixel are left black.
+    """
+    rng = np.random.default_rng(rng)
+    height, width = indices.shape
+    pixels = indices.flatten()
+    black_mask = is_black[pixels]
+    black = np.flatnonzero(black_mask)
+
+    count("black_pixels", len(black))
+    # The black pixels which may have a painted neighbour, after the first pass only the black neighbours
+    # of the pixels just filled can have gained one, hence each black pixel is only examined a few times.
+    frontier = black
+    while len(frontier) > 0:
+        count("passes")
+        count("examined_pixels", len(frontier))
+        y, x = np.divmod(frontier, width)
+        neighbours = np.stack(
+            [frontier - width, frontier - 1, frontier + width, frontier + 1], axis=1
+        )
+        inside = np.stack([y != 0, x != 0, y != height - 1, x != width - 1], axis=1)
+        painted = inside & ~black_mask[np.where(inside, neighbours, 0)]
+
+        # Pick one of the painted neighbours uniformly, so each color is picked with probability proportional to its count.
+        counts = painted.sum(axis=1)
+        n = (rng.random(len(frontier)) * counts).astype(int)
+        picked = np.argmax(np.cumsum(painted, axis=1) > n[:, None], axis=1)
+
+        # If there are nothing but black neighbours, skip the pixel for now.
+        fill = counts != 0
+        if not fill.any():
+            break
+        filled = frontier[fill]
+        pixels[filled] = pixels[neighbours[fill, picked[fill]]]
+        black_mask[filled] = False
+
+        candidates = neighbours[fill][inside[fill]]
+        frontier = np.unique(candidates[black_mask[candidates]])
+
+    # The pixels which can't be reached from a painted pixel, which should only happen within a tile or band.
+    count("unfilled_black_pixels", np.count_nonzero(black_mask[black]))
+    return pixels.reshape(height, width)
+
+
+def remove_black_pixels(canvas: Canvas, rng: np.random.Generator = None) -> Canvas:
+    """Remove the black colored pixels, by replacing them with the color adjecent to them.
+
+    Each pass fills every black pixel with a painted neighbour at once, and the following pass only looks at
+    the black neighbours of the pixels filled, so the time is linear in the number of black pixels.
+    """
+    indices, palette = canvas.to_indices()
+    is_black = ~palette.any(axis=-1)
+    if is_black[indices].all() and indices.size != 0:
+        raise ValueError(
+            "Can't remove the black pixels of a canvas without any painted pixels."
+        )
+
+    canvas.from_indices(remove_black_pixels_indices(indices, is_black, rng), palette)
+    return canvas
+
+
 class Group:
-    """A group of pixels with the same color."""
+    """A group of pixels with the same color, backed by the arrays of the groups it belongs to.
+
+    The points of the group are only materialized when they're needed.
+    """
 
-    points: List[Tuple[int]]
-    color: ArrayLike
+    __slots__ = ("groups", "label", "_points")
+
+    def __init__(self, groups: "Groups", label: int):
+        """Initialize the group from its label."""
+        self.groups = groups
+        self.label = label
+        self._points = None
 
     def __repr__(self) -> str:
         """Return a string repr of the group."""
-        return f"[color: {self.color}, points: {self.points}]"
+        return f"[color: {self.color}, size: {self.size}, bounding box: {self.bounding_box}]"
+
+    @property
+    def color_index(self) -> int:
+        """Return the index of the color of the group in the palette."""
+        return int(self.groups.colors[self.label])
+
+    @property
+    def color(self) -> Tuple[int]:
+        """Return the color of the group."""
+        return tuple(self.groups.palette[self.color_index].tolist())
+
+    @property
+    def size(self) -> int:
+        """Return the number of pixels in the group."""
+        return int(self.groups.sizes[self.label])
+
+    @property
+    def bounding_box(self) -> Tuple[int]:
+        """Return the bounding box of the group as (y0, x0, y1, x1), where y1 and x1 are exclusive."""
+        return tuple(self.groups.bounding_boxes[self.label].tolist())
+
+    @property
+    def points(self) -> ArrayLike:
+        """Return the (y, x) coordinates of the pixels in the group, as an int32 array."""
+        if self._points is None:
+            start = self.groups.starts[self.label]
+            pixels = self.groups.order[start : start + self.size]
+            self._points = np.column_stack(np.divmod(pixels, self.groups.width))
+        return self._points
 
     def get_adjecent_points(self) -> Iterable[Tuple[int]]:
         """Iteraterates over the adjecent points to the group."""
-        points_and_neighbours = sum(
-            [list(adjecent_pixels(*point)) for point in self.points], []
+        height, width = self.groups.labels.shape
+        y0, x0, y1, x1 = self.bounding_box
+        y0, x0, y1, x1 = (
+            max(y0 - 1, 0),
+            max(x0 - 1, 0),
+            min(y1 + 1, height),
+            min(x1 + 1, width),
         )
-        for point in iter(set(points_and_neighbours).difference(set(self.points))):
+        inside = self.groups.labels[y0:y1, x0:x1] == self.label
+
+        adjecent = np.zeros_like(inside)
+        adjecent[1:, :] |= inside[:-1, :]
+        adjecent[:-1, :] |= inside[1:, :]
+        adjecent[:, 1:] |= inside[:, :-1]
+        adjecent[:, :-1] |= inside[:, 1:]
+        ys, xs = np.nonzero(adjecent & ~inside)
+        for point in zip((ys + y0).tolist(), (xs + x0).tolist()):
             yield point
 
 
-def flod_fill(color_map: ArrayLike, point: Tuple[int], color: Tuple[int]) -> Group:
-    """Perform a flod fill to find the current group."""
-    group = Group([point], color)
-    adjecent_points_with_same_color = list(
-        filter(lambda point: color_map[point], list(adjecent_pixels(*point)))
+class Groups:
+    """The groups of a canvas, stored as arrays indexed by the labels of the groups."""
+
+    def __init__(
+        self, labels: ArrayLike, colors: ArrayLike, sizes: ArrayLike, palette: ArrayLike
+    ):
+        """Initialize the groups from the label image, along with the color index and size of each label."""
+        self.labels = labels
+        self.width = labels.shape[1]
+        self.colors = colors
+        self.sizes = sizes
+        self.palette = palette
+
+        # Sort the pixels by their label, such that the points of each group are contiguous.
+        self.order = np.argsort(labels.ravel(), kind="stable").astype(np.int32)
+        self.starts = np.concatenate([[0], np.cumsum(sizes)[:-1]]).astype(np.int32)
+        ys, xs = np.divmod(self.order, self.width)
+        self.bounding_boxes = np.column_stack(
+            [
+                np.minimum.reduceat(ys, self.starts),
+                np.minimum.reduceat(xs, self.starts),
+                np.maximum.reduceat(ys, self.starts) + 1,
+                np.maximum.reduceat(xs, self.starts) + 1,
+            ]
+        ).astype(np.int32)
+
+    def __len__(self) -> int:
+        """Return the number of groups."""
+        return len(self.sizes)
+
+    def __getitem__(self, label: int) -> Group:
+        """Return the group with the given label."""
+        if not -len(self) <= label < len(self):
+            raise IndexError(f"Expected a label below {len(self)} got {label}.")
+        return Group(self, label % len(self))
+
+    def __iter__(self) -> Iterable[Group]:
+        """Iterate over the groups, in the order of their labels."""
+        for label in range(len(self)):
+            yield Group(self, label)
+
+
+def get_groups(canvas: Canvas) -> Tuple[Groups, ArrayLike]:
+    """Find the groups (the clumps of colors), along with the label image mapping each pixel to its group."""
+    indices, palette = canvas.to_indices()
+    labels, colors, sizes = label_groups(indices)
+
+    return Groups(labels, colors, sizes, palette), labels
+
+
+def pick_colors(
+    regions: ArrayLike,
+    colors: ArrayLike,
+    weights: ArrayLike,
+    rng: np.random.Generator = None,
+) -> ArrayLike:
+    """Pick a color for each region randomly based on the weights, the arrays must be sorted by region.
+
+    Returns the index of the picked (region, color, weight) entry for each of the unique regions.
+    """
+    rng = np.random.default_rng(rng)
+    starts = np.flatnonzero(np.diff(regions, prepend=-1))
+    cumulative = np.cumsum(weights)
+    before = np.concatenate([[0], cumulative])[starts]
+    totals = np.append(cumulative[starts[1:] - 1], cumulative[-1]) - before
+    picked = np.searchsorted(
+        cumulative, before + rng.random(len(starts)) * totals, side="right"
     )
-    while len(adjecent_points_with_same_color) > 0:
-        group.points.extend(adjecent_points_with_same_color)
 
-        new = []
-        for (y, x) in adjecent_points_with_same_color:
-            for point in adjecent_pixels(y, x):
-                if color_map[point] and point not in group.points and point not in new:
-                    new.append(point)
+    # Guard against rounding errors picking an entry of the next region.
+    ends = np.append(starts[1:], len(regions)) - 1
+    return np.minimum(picked, ends)
 
-        adjecent_points_with_same_color = new
 
-    return group
+def remove_blobs_indices(
+    indices: ArrayLike,
+    passes: int = 1,
+    cutof: int = CUTOF,
+    verbose: bool = True,
+    rng: np.random.Generator = None,
+    frozen: ArrayLike = None,
+) -> ArrayLike:
+    """Remove the blobs of an index image, see remove_blobs.
 
+    The groups containing any of the frozen pixels (a boolean mask) are never recolored.
+    """
+    rng = np.random.default_rng(rng)
+    labels, colors, sizes = label_groups(indices)
+    graph = RegionGraph(labels, colors, sizes)
+    regions_of_labels = np.arange(len(graph))
+    is_frozen = np.zeros(len(graph), dtype=bool)
+    if frozen is not None:
+        is_frozen[labels[frozen]] = True
 
-# TODO: Find speed ups?
-def get_groups(canvas: Canvas) -> List[Group]:
-    """Find the groups (the clumps of colors)."""
-    grouped = []
-    groups = []
-    color_maps = {
-        color: (canvas.tensor == np.full((HEIGHT, WIDTH, 3), color, dtype="uint8")).all(
-            axis=-1
-        )
-        for color in COLORS
-    }
-    for (y0, x0) in tqdm(canvas.pixels()):
-        if (y0, x0) not in grouped:
-            # Group pixels of the same colors together using flod fill
-            color = tuple(canvas.get_color_of_pixel(y0, x0))
+    for _ in range(passes):
+        sizes, counts = np.unique(graph.sizes, return_counts=True)
+        distr = dict(zip(sizes.tolist(), counts.tolist()))
+        if verbose:
+            print(
+                f"Found {len(graph)} group, with the number of pixels in each group taking the distribution: {distr}"
+            )
+
+        regions, colors, weights = graph.neighbour_colors()
+        if len(regions) == 0:
+            break
+        picked = pick_colors(regions, colors, weights, rng)
+        number_of_colors = np.bincount(regions, minlength=len(graph))[regions[picked]]
 
-            groups.append(flod_fill(color_maps[color], (y0, x0), color))
+        # Color the group if it's sorrounded by the same color, or if it's small.
+        recolor = (number_of_colors == 1) | (graph.sizes[regions[picked]] <= cutof)
+        recolor &= ~is_frozen[regions[picked]]
+        count("groups_found", len(graph))
+        count("groups_recolored", np.count_nonzero(recolor))
+        mapping = graph.recolor(regions[picked][recolor], colors[picked][recolor])
+        regions_of_labels = mapping[regions_of_labels]
+        is_frozen = np.bincount(mapping, weights=is_frozen, minlength=len(graph)) > 0
 
-            grouped.extend(groups[-1].points)
+    return graph.colors[regions_of_labels[labels]].astype(indices.dtype)
 
-    return groups
 
+def remove_blobs(
+    canvas: Canvas,
+    passes: int = 1,
+    cutof: int = CUTOF,
+    verbose: bool = True,
+    rng: np.random.Generator = None,
+) -> Canvas:
+    """Remove the blobs thats inside of a bigger blob (of a different color).
 
-def find_group(point: Tuple[int], groups: List[Group]) -> Group:
-    """Find the group which the point belongs to."""
-    for group in groups:
-        if point in group.points:
-            return group
+    The region adjacency graph is built once, and updated as the regions are recolored and merged in each pass.
+    """
+    indices, palette = canvas.to_indices()
+    canvas.from_indices(
+        remove_blobs_indices(indices, passes, cutof, verbose, rng), palette
+    )
+    return canvas
 
 
-def pick_color(colors_and_weights: Dict[Tuple[int], int]) -> Tuple[int]:
-    """Pick a color randomly based on the weights."""
-    total = sum(colors_and_weights.values())
-    n = random.randint(0, total)
-    sum_of_weights = 0
-    for color, weight in colors_and_weights.items():
-        if n <= sum_of_weights + weight:
-            return color
-        else:
-            sum_of_weights += weight
+def box_sums(mask: ArrayLike, kernel_size: int) -> ArrayLike:
+    """Count the true values of the mask in the window around each pixel, using an integral image.
+
+    The mask is padded with zeros, hence the windows are effectively clipped at the edges of the mask.
+    """
+    integral = np.zeros(
+        (mask.shape[0] + kernel_size, mask.shape[1] + kernel_size), dtype=np.int32
+    )
+    r = kernel_size // 2
+    integral[r + 1 : r + 1 + mask.shape[0], r + 1 : r + 1 + mask.shape[1]] = mask
+    np.cumsum(integral, axis=0, out=integral)
+    np.cumsum(integral, axis=1, out=integral)
+
+    k = kernel_size
+    return integral[k:, k:] - integral[:-k, k:] - integral[k:, :-k] + integral[:-k, :-k]
 
 
-def remove_blobs(canvas: Canvas) -> Canvas:
-    """Remove the blobs thats inside of a bigger blob (of a different color)."""
-    old_canvas = deepcopy(canvas)
-    groups = get_groups(canvas)
+def majority_filter_indices(
+    indices: ArrayLike,
+    kernel_size: int = MAJORITY_KERNEL_SIZE,
+    iterations: int = 1,
+    cutof: int = CUTOF,
+) -> ArrayLike:
+    """Apply the majority filter to an index image, see majority_filter."""
+    if cutof is not None:
+        labels, _, sizes = label_groups(indices)
+        small = sizes[labels] <= cutof
+        del labels
 
-    list_of_lengths = [len(group.points) for group in groups]
-    distr = {n: list_of_lengths.count(n) for n in sorted(list(set(list_of_lengths)))}
-    print(
-        f"Found {len(groups)} group, with the number of pixels in each group taking the distribution: {distr}"
+    for _ in range(iterations):
+        best_count = np.zeros(indices.shape, dtype=np.int32)
+        best = indices.copy()
+        for color in np.flatnonzero(np.bincount(indices.ravel())):
+            is_color = indices == color
+            # Counting the current color twice plus one, breaks ties in its favour.
+            counts = 2 * box_sums(is_color, kernel_size) + is_color
+            better = counts > best_count
+            best[better] = color
+            best_count[better] = counts[better]
+
+        if cutof is not None:
+            best = np.where(small, best, indices)
+
+        changed = np.count_nonzero(best != indices)
+        count("pixels_changed", changed)
+        indices = best
+        if changed == 0:
+            break
+
+    return indices
+
+
+def majority_filter(
+    canvas: Canvas,
+    kernel_size: int = MAJORITY_KERNEL_SIZE,
+    iterations: int = 1,
+    cutof: int = CUTOF,
+) -> Canvas:
+    """Remove the noise, by giving the pixels the most common color in the window around them.
+
+    Only the pixels in groups of at most cutof pixels (in the original canvas) are recolored, or all of them
+    if cutof is None. Ties are broken in favour of the current color of the pixel. The time is linear in the
+    number of pixels.
+    """
+    indices, palette = canvas.to_indices()
+    canvas.from_indices(
+        majority_filter_indices(indices, kernel_size, iterations, cutof), palette
     )
-    for idx, group in enumerate(groups):
-        # TODO: MAKE THIS WEIGHTED.
-        colors_and_weights = {}
-        for (y, x) in group.get_adjecent_points():
-            adjecent_group = find_group((y, x), groups)
-            color = tuple(old_canvas.get_color_of_pixel(y, x))
-            colors_and_weights[color] = colors_and_weights.get(color, 0) + len(
-                adjecent_group.points
-            )
+    return canvas
+
+
+def remove_noise(
+    canvas: Canvas,
+    mode: str = NOISE_REMOVAL,
+    passes: int = PASSES_REMOVING_NOISE,
+    cutof: int = CUTOF,
+    verbose: bool = True,
+    rng: np.random.Generator = None,
+) -> Canvas:
+    """Remove the noise with either remove_blobs ("blobs") or majority_filter ("majority")."""
+    if mode == "blobs":
+        return remove_blobs(canvas, passes, cutof, verbose, rng)
+    elif mode == "majority":
+        return majority_filter(canvas, MAJORITY_KERNEL_SIZE, passes, cutof)
+    else:
+        raise ValueError(f"Expected the mode to be 'blobs' or 'majority' got {mode}.")
+
+
+def _fill_tile(
+    indices: ArrayLike, edges: ArrayLike, rng: np.random.Generator, is_black: ArrayLike
+) -> ArrayLike:
+    """Remove the black pixels of a tile, used by tiled_remove_black_pixels."""
+    return remove_black_pixels_indices(indices, is_black, rng)
 
-        # Color the group if it's sorrounded by the same color
-        if len(colors_and_weights) == 1 or len(group.points) <= 16:
-            color = np.array(pick_color(colors_and_weights))
-            for (y, x) in group.points:
-                canvas.set_pixel(y, x, color)
 
+def _remove_blobs_tile(
+    indices: ArrayLike,
+    edges: ArrayLike,
+    rng: np.random.Generator,
+    passes: int,
+    cutof: int,
+) -> ArrayLike:
+    """Remove the blobs of a tile, used by tiled_remove_noise.
+
+    The groups touching the edges of the tile may continue into the neighbouring tiles, hence their sizes
+    and neighbours are unknown, so they're left for the pass over the whole canvas.
+    """
+    return remove_blobs_indices(indices, passes, cutof, False, rng, frozen=edges)
+
+
+def _majority_filter_tile(
+    indices: ArrayLike,
+    edges: ArrayLike,
+    rng: np.random.Generator,
+    kernel_size: int,
+    iterations: int,
+    cutof: int,
+) -> ArrayLike:
+    """Apply the majority filter to a tile, used by tiled_remove_noise."""
+    return majority_filter_indices(indices, kernel_size, iterations, cutof)
+
+
+def _process_tile(
+    name: str,
+    output_name: str,
+    shape: Tuple[int],
+    dtype: str,
+    tile: Tuple[int],
+    core: Tuple[int],
+    function: Callable,
+    arguments: Tuple,
+    seed: int,
+):
+    """Process a tile of a shared memory index image, and write the core of the tile to the output."""
+    y0, y1, x0, x1 = tile
+    cy0, cy1, cx0, cx1 = core
+    shm = shared_memory.SharedMemory(name=name)
+    output_shm = shared_memory.SharedMemory(name=output_name)
+    try:
+        indices = np.ndarray(shape, dtype=dtype, buffer=shm.buf)[y0:y1, x0:x1].copy()
+
+        # The pixels on the edges of the tile, which aren't on the edges of the canvas.
+        edges = np.zeros(indices.shape, dtype=bool)
+        edges[0, :] |= y0 > 0
+        edges[-1, :] |= y1 < shape[0]
+        edges[:, 0] |= x0 > 0
+        edges[:, -1] |= x1 < shape[1]
+
+        result = function(indices, edges, np.random.default_rng(seed), *arguments)
+        output = np.ndarray(shape, dtype=dtype, buffer=output_shm.buf)
+        output[cy0:cy1, cx0:cx1] = result[cy0 - y0 : cy1 - y0, cx0 - x0 : cx1 - x0]
+        del output
+    finally:
+        shm.close()
+        output_shm.close()
+
+
+def map_tiles(
+    indices: ArrayLike,
+    function: Callable,
+    arguments: Tuple,
+    number_of_processes: int = NUMBER_OF_PROCESSES,
+    tiles: Tuple[int] = None,
+    halo: int = TILE_OVERLAP,
+    rng: np.random.Generator = None,
+) -> ArrayLike:
+    """Split the index image into tiles, which extend halo pixels into their neighbours, and process them in parallel.
+
+    The function is called with the indices of the tile, the mask of the edges of the tile (those which aren't
+    edges of the canvas), a generator and the arguments. Only the core of each tile (without the halo) is kept.
+    """
+    rng = np.random.default_rng(rng)
+    height, width = indices.shape
+    if tiles is None:
+        n = int(np.ceil(np.sqrt(4 * number_of_processes)))
+        tiles = (n, n)
+    rows = np.linspace(0, height, tiles[0] + 1, dtype=int)
+    columns = np.linspace(0, width, tiles[1] + 1, dtype=int)
+    seeds = np.random.SeedSequence(rng.integers(1 << 63)).spawn(tiles[0] * tiles[1])
+
+    # The tiles read from one copy and write to another, such that the tiles can be processed in any order.
+    shm = shared_memory.SharedMemory(create=True, size=max(indices.nbytes, 1))
+    output_shm = shared_memory.SharedMemory(create=True, size=max(indices.nbytes, 1))
+    try:
+        shared = np.ndarray(indices.shape, dtype=indices.dtype, buffer=shm.buf)
+        shared[:] = indices
+        jobs = []
+        for i in range(tiles[0]):
+            for j in range(tiles[1]):
+                core = (rows[i], rows[i + 1], columns[j], columns[j + 1])
+                tile = (
+                    max(rows[i] - halo, 0),
+                    min(rows[i + 1] + halo, height),
+                    max(columns[j] - halo, 0),
+                    min(columns[j + 1] + halo, width),
+                )
+                seed = int(seeds[i * tiles[1] + j].generate_state(1)[0])
+                jobs.append(
+                    (
+                        shm.name,
+                        output_shm.name,
+                        indices.shape,
+                        indices.dtype.str,
+                        tile,
+                        core,
+                        function,
+                        arguments,
+                        seed,
+                    )
+                )
+
+        with Pool(number_of_processes) as pool:
+            pool.starmap(_process_tile, jobs)
+        result = np.ndarray(indices.shape, dtype=indices.dtype, buffer=output_shm.buf)
+        result = result.copy()
+        del shared
+    finally:
+        shm.close()
+        shm.unlink()
+        output_shm.close()
+        output_shm.unlink()
+
+    return result
+
+
+def tiled_remove_black_pixels(
+    canvas: Canvas,
+    number_of_processes: int = NUMBER_OF_PROCESSES,
+    tiles: Tuple[int] = None,
+    halo: int = TILE_OVERLAP,
+    rng: np.random.Generator = None,
+) -> Canvas:
+    """Remove the black pixels as in remove_black_pixels, with the canvas split into tiles processed in parallel.
+
+    The black pixels, which can't be reached from a painted pixel within their tile, are removed in a final
+    pass over the whole canvas, hence no black pixels are left.
+    """
+    rng = np.random.default_rng(rng)
+    indices, palette = canvas.to_indices()
+    is_black = ~palette.any(axis=-1)
+    if is_black[indices].all() and indices.size != 0:
+        raise ValueError(
+            "Can't remove the black pixels of a canvas without any painted pixels."
+        )
+
+    indices = indices.astype(np.min_scalar_type(len(palette) - 1))
+    indices = map_tiles(
+        indices, _fill_tile, (is_black,), number_of_processes, tiles, halo, rng
+    )
+    canvas.from_indices(remove_black_pixels_indices(indices, is_black, rng), palette)
     return canvas
 
 
-def main():
-    """Run the script."""
-    canvas = random_walk(Canvas(WIDTH, HEIGHT))
-    canvas.save("random_walk.png")
+def tiled_remove_noise(
+    canvas: Canvas,
+    number_of_processes: int = NUMBER_OF_PROCESSES,
+    tiles: Tuple[int] = None,
+    halo: int = TILE_OVERLAP,
+    mode: str = NOISE_REMOVAL,
+    passes: int = PASSES_REMOVING_NOISE,
+    cutof: int = CUTOF,
+    verbose: bool = True,
+    rng: np.random.Generator = None,
+) -> Canvas:
+    """Remove the noise as in remove_noise, with the canvas split into tiles processed in parallel.
+
+    For the majority filter the halo is widened, such that the result is the same as without the tiles. For
+    the blobs, the groups crossing the edges of the tiles are merged and recolored in a final pass over the
+    whole canvas, which is much cheaper than the passes over the noisy canvas.
+    """
+    rng = np.random.default_rng(rng)
+    indices, palette = canvas.to_indices()
+    indices = indices.astype(np.min_scalar_type(len(palette) - 1))
 
-    print("removing black pixles.")
-    canvas = remove_black_pixels(canvas)
-    canvas.save("after_removing_black_pixels.png")
+    if mode == "blobs":
+        indices = map_tiles(
+            indices,
+            _remove_blobs_tile,
+            (passes, cutof),
+            number_of_processes,
+            tiles,
+            max(halo, cutof + 1),
+            rng,
+        )
+        indices = remove_blobs_indices(indices, 1, cutof, verbose, rng)
+    elif mode == "majority":
+        # The sizes of the groups are only wrong within cutof pixels of the edges of a tile, and the errors
+        # spread by half the kernel size in each iteration, hence they never reach the core of the tile.
+        halo = max(halo, (cutof or 0) + MAJORITY_KERNEL_SIZE // 2 * passes + 1)
+        indices = map_tiles(
+            indices,
+            _majority_filter_tile,
+            (MAJORITY_KERNEL_SIZE, passes, cutof),
+            number_of_processes,
+            tiles,
+            halo,
+            rng,
+        )
+    else:
+        raise ValueError(f"Expected the mode to be 'blobs' or 'majority' got {mode}.")
+
+    canvas.from_indices(indices, palette)
+    return canvas
+
+
+def map_bands(
+    indices: ArrayLike,
+    function: Callable,
+    arguments: Tuple,
+    rows: int = BAND_ROWS,
+    halo: int = TILE_OVERLAP,
+    rng: np.random.Generator = None,
+    offset: int = 0,
+) -> ArrayLike:
+    """Process the index image in bands of rows, which extend halo rows into their neighbours, one band at a time.
+
+    The functions are the same as for map_tiles, however the index image is processed in place, such that it can
+    be a memory mapped file, of which only a single band is held in memory. The edges of the bands are shifted
+    down by the offset.
+    """
+    rng = np.random.default_rng(rng)
+    height = indices.shape[0]
+    edges = np.unique(np.r_[0, np.arange(offset % rows, height, rows), height])
+    seeds = np.random.SeedSequence(rng.integers(1 << 63)).spawn(len(edges) - 1)
+
+    # The rows above the band, as they were before the previous band was written back.
+    above = indices[:0].copy()
+    for y0, y1, seed in zip(edges[:-1], edges[1:], seeds):
+        top, bottom = max(y0 - halo, 0), min(y1 + halo, height)
+        band = np.concatenate([above, indices[y0:bottom]])
+        above = band[max(y1 - halo, 0) - top : y1 - top].copy()
+
+        edge = np.zeros(band.shape, dtype=bool)
+        edge[0, :] |= top > 0
+        edge[-1, :] |= bottom < height
+        result = function(band, edge, np.random.default_rng(seed), *arguments)
+        indices[y0:y1] = result[y0 - top : y1 - top]
+
+    return indices
+
+
+def banded_remove_black_pixels(
+    canvas: IndexedCanvas,
+    rows: int = BAND_ROWS,
+    halo: int = TILE_OVERLAP,
+    rng: np.random.Generator = None,
+) -> IndexedCanvas:
+    """Remove the black pixels as in remove_black_pixels, a band of rows at a time.
+
+    Black pixels which can't be reached from a painted pixel within their band are filled by the following
+    passes over the bands, the edges of which are shifted by half a band each time.
+    """
+    if not isinstance(canvas, IndexedCanvas):
+        raise ValueError(
+            "Expected an IndexedCanvas, as the indices of an rgb canvas are computed over the whole canvas."
+        )
+    rng = np.random.default_rng(rng)
+    indices, palette = canvas.to_indices()
+    is_black = ~palette.any(axis=-1)
+
+    def number_of_black_pixels() -> int:
+        """Count the black pixels, a band at a time."""
+        return sum(
+            int(np.count_nonzero(is_black[indices[band]]))
+            for band in row_bands(canvas.height, rows)
+        )
+
+    black, offset = number_of_black_pixels(), 0
+    if black == indices.size and indices.size != 0:
+        raise ValueError(
+            "Can't remove the black pixels of a canvas without any painted pixels."
+        )
+
+    while black > 0:
+        map_bands(indices, _fill_tile, (is_black,), rows, halo, rng, offset)
+        black, offset = number_of_black_pixels(), offset + rows // 2
+
+    canvas.from_indices(indices, palette)
+    return canvas
+
+
+def banded_remove_noise(
+    canvas: IndexedCanvas,
+    rows: int = BAND_ROWS,
+    halo: int = TILE_OVERLAP,
+    mode: str = NOISE_REMOVAL,
+    passes: int = PASSES_REMOVING_NOISE,
+    cutof: int = CUTOF,
+    rng: np.random.Generator = None,
+) -> IndexedCanvas:
+    """Remove the noise as in tiled_remove_noise, a band of rows at a time.
+
+    For the blobs, the groups crossing the edges of the bands are recolored by a single pass over the bands,
+    shifted by half a band, rather than a pass over the whole canvas.
+    """
+    if not isinstance(canvas, IndexedCanvas):
+        raise ValueError(
+            "Expected an IndexedCanvas, as the indices of an rgb canvas are computed over the whole canvas."
+        )
+    rng = np.random.default_rng(rng)
+    indices, palette = canvas.to_indices()
+
+    if mode == "blobs":
+        halo = max(halo, cutof + 1)
+        if rows // 2 <= halo:
+            raise ValueError(
+                f"Expected the bands to be more than twice the halo ({halo}) got {rows} rows."
+            )
+        map_bands(indices, _remove_blobs_tile, (passes, cutof), rows, halo, rng)
+        map_bands(indices, _remove_blobs_tile, (1, cutof), rows, halo, rng, rows // 2)
+    elif mode == "majority":
+        # See tiled_remove_noise.
+        halo = max(halo, (cutof or 0) + MAJORITY_KERNEL_SIZE // 2 * passes + 1)
+        map_bands(
+            indices,
+            _majority_filter_tile,
+            (MAJORITY_KERNEL_SIZE, passes, cutof),
+            rows,
+            halo,
+            rng,
+        )
+    else:
+        raise ValueError(f"Expected the mode to be 'blobs' or 'majority' got {mode}.")
+
+    canvas.from_indices(indices, palette)
+    return canvas
+
+
+def pipeline_stages(seed: int = SEED) -> List[Stage]:
+    """Return the stages of the script (the walk, removing the black pixels and removing the noise) from the config.
+
+    The parameters of each stage are the settings which affect its result.
+    """
+    # Without a SEED, the walk is seeded with fresh entropy, which is part of its parameters, hence each run
+    # generates a new wallpaper, rather than resuming from the checkpoints of the previous one.
+    seeds = np.random.SeedSequence(seed)
+    walk, black_pixels, noise = map(np.random.default_rng, seeds.spawn(3))
+    walk_parameters = {
+        "colors": COLORS,
+        "ratios": RATIOS,
+        "width": WIDTH,
+        "height": HEIGHT,
+        "probability_for_color_to_stay_the_same": PROBABILITY_FOR_COLOR_TO_STAY_THE_SAME,
+        "number_of_steps": NUMBER_OF_STEPS,
+        "seed": seeds.entropy,
+    }
+    # The tiled walk copies the canvas to shared memory, hence it isn't used for canvases kept in a file.
+    if NUMBER_OF_PROCESSES > 1 and CANVAS_FILE is None:
+        walk_stage = Stage(
+            "tiled-walk",
+            {
+                **walk_parameters,
+                "number_of_processes": NUMBER_OF_PROCESSES,
+                "number_of_walkers": NUMBER_OF_WALKERS,
+                "target_coverage": TARGET_COVERAGE,
+                "tile_overlap": TILE_OVERLAP,
+            },
+            lambda canvas: tiled_random_walk(canvas, rng=walk),
+        )
+    else:
+        walk_stage = Stage(
+            "walk",
+            {
+                **walk_parameters,
+                "number_of_walkers": NUMBER_OF_WALKERS,
+                "target_coverage": TARGET_COVERAGE,
+            },
+            lambda canvas: multi_walker_random_walk(canvas, rng=walk),
+        )
+
+    noise_parameters = {
+        "mode": NOISE_REMOVAL,
+        "passes": PASSES_REMOVING_NOISE,
+        "cutof": CUTOF,
+        "kernel_size": MAJORITY_KERNEL_SIZE,
+    }
+    if CANVAS_FILE is not None:
+        band_parameters = {"band_rows": BAND_ROWS, "tile_overlap": TILE_OVERLAP}
+        black_pixels_stage = Stage(
+            "banded-black-pixels",
+            band_parameters,
+            lambda canvas: banded_remove_black_pixels(canvas, rng=black_pixels),
+        )
+        noise_stage = Stage(
+            "banded-noise",
+            {**noise_parameters, **band_parameters},
+            lambda canvas: banded_remove_noise(canvas, rng=noise),
+        )
+    elif NUMBER_OF_PROCESSES > 1:
+        tile_parameters = {
+            "number_of_processes": NUMBER_OF_PROCESSES,
+            "tile_overlap": TILE_OVERLAP,
+        }
+        black_pixels_stage = Stage(
+            "tiled-black-pixels",
+            tile_parameters,
+            lambda canvas: tiled_remove_black_pixels(canvas, rng=black_pixels),
+        )
+        noise_stage = Stage(
+            "tiled-noise",
+            {**noise_parameters, **tile_parameters},
+            lambda canvas: tiled_remove_noise(canvas, rng=noise),
+        )
+    else:
+        black_pixels_stage = Stage(
+            "black-pixels",
+            {},
+            lambda canvas: remove_black_pixels(canvas, black_pixels),
+        )
+        noise_stage = Stage(
+            "noise", noise_parameters, lambda canvas: remove_noise(canvas, rng=noise)
+        )
+
+    return [walk_stage, black_pixels_stage, noise_stage]
+
+
+def main():
+    """Run the script, resuming from the checkpoints of the stages which are unaffected by changes to the config."""
+    # A canvas kept in a file is always indexed, as the banded stages only work on the indices.
+    if INDEXED_CANVAS or CANVAS_FILE is not None:
+        canvas = IndexedCanvas(WIDTH, HEIGHT, COLORS, file_path=CANVAS_FILE)
+    else:
+        canvas = Canvas(WIDTH, HEIGHT, file_path=CANVAS_FILE)
 
-    print("removing blobs.")
-    for _ in range(PASSES_REMOVING_NOISE):
-        canvas = remove_blobs(canvas)
+    profiler = Profiler(PROFILE_STAGE, PROFILE_MEMORY)
+    canvas = run_pipeline(canvas, pipeline_stages(), profiler=profiler)
 
-    canvas.save("after_removing_noise.png")
+    with profiler.stage("save", pixels=canvas.width * canvas.height * (1 + SCALE**2)):
+        # The two images are encoded in parallel, as zlib releases the GIL.
+        with BackgroundEncoder() as encoder:
+            encoder.submit(canvas.save, "after_removing_noise.png")
+            save_scaled(canvas, SCALE, "scaled.png")
 
-    scale_up_by(canvas, SCALE).save("scaled.png")
+    if PROFILE_REPORT is not None:
+        profiler.save(PROFILE_REPORT)
 
 
 if __name__ == "__main__":
@@ -0,0 +1,142 @@
+#!/usr/bin/env python3
+from typing import Callable, Dict, List, Tuple
+import numpy as np
+from numpy.typing import ArrayLike
+from config import COLORS, RATIOS
+
+# The fraction of the canvas covered by discs of radius r / 2, centered on the points of a maximal
+# Poisson disc sampling with radius r, this is used to pick the radius giving a number of points.
+POISSON_DISC_DENSITY = 0.547
+
+
+def palette_colors(
+    n: int,
+    colors: List[Tuple[int]] = COLORS,
+    ratios: List[int] = RATIOS,
+    rng: np.random.Generator = None,
+) -> ArrayLike:
+    """Draw n colors from the palette, each color is picked with a probability proportional to its ratio."""
+    rng = np.random.default_rng(rng)
+    weights = np.array(ratios) / sum(ratios)
+    return np.array(colors, dtype="uint8")[rng.choice(len(colors), size=n, p=weights)]
+
+
+def uniform_points(
+    width: int, height: int, n: int, rng: np.random.Generator = None
+) -> ArrayLike:
+    """Draw n points (y, x) uniformly from the pixels of the canvas."""
+    rng = np.random.default_rng(rng)
+    return np.column_stack(
+        [rng.integers(0, height, size=n), rng.integers(0, width, size=n)]
+    )
+
+
+def jittered_grid_points(
+    width: int, height: int, n: int, rng: np.random.Generator = None
+) -> ArrayLike:
+    """Split the canvas into a grid of roughly n cells, of roughly square shape, and draw a point in each cell."""
+    rng = np.random.default_rng(rng)
+    rows = int(np.clip(np.round(np.sqrt(n * height / width)), 1, height))
+    columns = int(np.clip(np.round(n / rows), 1, width))
+    ys, xs = np.mgrid[0:rows, 0:columns]
+    ys = (ys.ravel() + rng.random(rows * columns)) * (height / rows)
+    xs = (xs.ravel() + rng.random(rows * columns)) * (width / columns)
+    return np.column_stack([ys.astype(np.int64), xs.astype(np.int64)])
+
+
+def poisson_disc_radius(width: int, height: int, n: int) -> float:
+    """Return the radius, for which a maximal Poisson disc sampling of the canvas has roughly n points."""
+    return np.sqrt(4 * POISSON_DISC_DENSITY * width * height / (np.pi * max(n, 1)))
+
+
+def poisson_disc_points(
+    width: int,
+    height: int,
+    radius: float,
+    rng: np.random.Generator = None,
+    attempts: int = 8,
+) -> ArrayLike:
+    """Draw points (y, x) which are at least the radius apart, by throwing darts at a grid of cells.
+
+    The cells are radius / sqrt(2) wide, such that each cell holds at most one point, and a point can only be
+    too close to the points within two cells of it. The cells are split into 9 phases, cells of the same phase
+    are 3 cells apart, hence the darts thrown at the empty cells of a phase can be checked all at once. Each
+    empty cell gets a dart in each of the attempts, after which the sampling is close to maximal.
+    """
+    rng = np.random.default_rng(rng)
+    size = radius / np.sqrt(2)
+    rows, columns = int(np.ceil(height / size)), int(np.ceil(width / size))
+    # The point in each cell, NaN if it's empty, the grid is padded with 2 empty cells on each side and flattened.
+    stride = columns + 4
+    grid_y = np.full((rows + 4) * stride, np.nan)
+    grid_x = np.full((rows + 4) * stride, np.nan)
+    # The closest cells first, as they're the most likely to reject the dart, which is then dropped.
+    offsets = sorted(
+        [(dy, dx) for dy in range(-2, 3) for dx in range(-2, 3) if dy or dx],
+        key=lambda offset: offset[0] ** 2 + offset[1] ** 2,
+    )
+
+    ys, xs = np.mgrid[2 : rows + 2, 2 : columns + 2]
+    phases = [
+        (ys[i::3, j::3] * stride + xs[i::3, j::3]).ravel()
+        for i in range(3)
+        for j in range(3)
+    ]
+    for _ in range(attempts):
+        for i, cells in enumerate(phases):
+            cells = cells[np.isnan(grid_y[cells])]
+            phases[i] = cells
+            cy, cx = np.divmod(cells, stride)
+            # The darts are drawn from the pixels of the cells, rather than being rounded to pixels once they're
+            # accepted, which could move them closer together.
+            y0, y1 = np.ceil((cy - 2) * size), np.ceil((cy - 1) * size)
+            x0, x1 = np.ceil((cx - 2) * size), np.ceil((cx - 1) * size)
+            y = y0 + np.floor(rng.random(len(cells)) * (y1 - y0))
+            x = x0 + np.floor(rng.random(len(cells)) * (x1 - x0))
+
+            fits = (y < np.minimum(y1, height)) & (x < np.minimum(x1, width))
+            cells, y, x = cells[fits], y[fits], x[fits]
+            for dy, dx in offsets:
+                neighbours = cells + (dy * stride + dx)
+                # NaN (an empty cell) is never too close.
+                fits = ~(
+                    (grid_y[neighbours] - y) ** 2 + (grid_x[neighbours] - x) ** 2
+                    < radius**2
+                )
+                cells, y, x = cells[fits], y[fits], x[fits]
+            grid_y[cells] = y
+            grid_x[cells] = x
+
+    filled = ~np.isnan(grid_y)
+    return np.column_stack([grid_y[filled], grid_x[filled]]).astype(np.int64)
+
+
+SAMPLERS: Dict[str, Callable[[int, int, int, np.random.Generator], ArrayLike]] = {
+    "uniform": uniform_points,
+    "jittered": jittered_grid_points,
+    "poisson": lambda width, height, n, rng: poisson_disc_points(
+        width, height, poisson_disc_radius(width, height, n), rng
+    ),
+}
+
+
+def sample_points(
+    sampling: str,
+    width: int,
+    height: int,
+    n: int,
+    colors: List[Tuple[int]] = COLORS,
+    ratios: List[int] = RATIOS,
+    rng: np.random.Generator = None,
+) -> Tuple[ArrayLike, ArrayLike]:
+    """Draw roughly n points with the sampling ("uniform", "jittered" or "poisson"), along with their colors.
+
+    Only the uniform sampling gives exactly n points, the others give as many as fits the grid or the radius.
+    """
+    if sampling not in SAMPLERS:
+        raise ValueError(
+            f"Expected one of the samplings {list(SAMPLERS)} got {sampling}."
+        )
+    rng = np.random.default_rng(rng)
+    points = SAMPLERS[sampling](width, height, n, rng)
+    return points, palette_colors(len(points), colors, ratios, rng)
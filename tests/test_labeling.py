@@ -0,0 +1,148 @@
+from collections import deque
+import numpy as np
+import pytest
+from labeling import RegionGraph, connected_components, label_groups, label_image
+from grid import Grid, RGB
+
+
+def flood_fill_labels(values):
+    """Label the 4-connected regions of equal values with a flood fill, numbered in scan order."""
+    height, width = values.shape
+    labels = np.full((height, width), -1)
+    n = 0
+    for y in range(height):
+        for x in range(width):
+            if labels[y, x] >= 0:
+                continue
+            labels[y, x] = n
+            queue = deque([(y, x)])
+            while queue:
+                py, px = queue.popleft()
+                for qy, qx in ((py - 1, px), (py + 1, px), (py, px - 1), (py, px + 1)):
+                    if (
+                        0 <= qy < height
+                        and 0 <= qx < width
+                        and labels[qy, qx] < 0
+                        and values[qy, qx] == values[py, px]
+                    ):
+                        labels[qy, qx] = n
+                        queue.append((qy, qx))
+            n += 1
+
+    return labels
+
+
+def serpentine(height, width):
+    """A single region winding through the image, separated from itself by walls of another value."""
+    values = np.ones((height, width), dtype=np.uint8)
+    for i, y in enumerate(range(1, height - 1, 2)):
+        if i % 2 == 0:
+            values[y, :-1] = 2
+        else:
+            values[y, 1:] = 2
+    return values
+
+
+@pytest.mark.parametrize("seed", range(5))
+@pytest.mark.parametrize(
+    "height, width", [(1, 1), (1, 17), (17, 1), (23, 31), (40, 12)]
+)
+def test_label_image(height, width, seed):
+    rng = np.random.default_rng(seed)
+    values = rng.integers(0, 1 + seed, size=(height, width))
+    labels, first = label_image(values)
+
+    expected = flood_fill_labels(values)
+    assert (labels == expected).all()
+    assert (labels.ravel()[first] == np.arange(len(first))).all()
+
+
+@pytest.mark.parametrize("height, width", [(9, 10), (31, 64), (64, 5)])
+def test_label_image_serpentine(height, width):
+    values = serpentine(height, width)
+    labels, colors, sizes = label_groups(values)
+
+    assert (labels == flood_fill_labels(values)).all()
+    # The winding region is a single group, however far apart its ends are.
+    assert colors[labels[0, 0]] == 1
+    assert sizes[labels[0, 0]] == np.count_nonzero(values == 1)
+    assert labels[0, 0] == labels[-1, -1]
+
+
+@pytest.mark.parametrize("seed", range(5))
+def test_connected_components(seed):
+    rng = np.random.default_rng(seed)
+    n = 200
+    a, b = rng.integers(0, n, size=(2, 150))
+    roots = connected_components(n, a, b)
+
+    # Breadth first search from each node, the root is the smallest node of its component.
+    adjacent = [[] for _ in range(n)]
+    for u, v in zip(a, b):
+        adjacent[u].append(v)
+        adjacent[v].append(u)
+    for node in range(n):
+        seen, queue = {node}, deque([node])
+        while queue:
+            for neighbour in adjacent[queue.popleft()]:
+                if neighbour not in seen:
+                    seen.add(neighbour)
+                    queue.append(neighbour)
+        assert roots[node] == min(seen)
+
+
+@pytest.mark.parametrize("seed", range(5))
+def test_grid_regions(seed):
+    colors = [RGB("ff0000"), RGB("00ff00"), RGB("0000ff")]
+    grid = Grid(5, 10, 20, 20, colors, RGB("000000"), 315, 240, rng=seed)
+    grid.chain_squares()
+    labels, palette_indices, sizes = grid.regions()
+
+    # The squares are chained with their neighbours of the same color, hence the blobs are the regions.
+    expected = flood_fill_labels(grid.squares)
+    assert (labels == expected).all()
+    assert (palette_indices[labels] == grid.squares).all()
+    assert (sizes == np.bincount(expected.ravel())).all()
+
+
+def region_graph(values):
+    """Build the region graph of the image from scratch."""
+    labels, colors, sizes = label_groups(values)
+    return labels, RegionGraph(labels, colors, sizes)
+
+
+@pytest.mark.parametrize("seed", range(10))
+def test_region_graph_recolor(seed):
+    rng = np.random.default_rng(seed)
+    values = rng.integers(1, 4, size=(30, 40))
+    labels, graph = region_graph(values)
+
+    for _ in range(3):
+        regions = rng.choice(len(graph), size=min(len(graph), 15), replace=False)
+        colors = rng.integers(1, 4, size=len(regions))
+        mapping = graph.recolor(regions, colors)
+
+        labels = mapping[labels]
+        values = graph.colors[labels]
+        expected_labels, expected = region_graph(values)
+
+        # The regions are numbered differently, but the labels must partition the pixels the same way.
+        pairs = np.unique(np.stack([labels.ravel(), expected_labels.ravel()]), axis=1)
+        assert len(pairs[0]) == len(np.unique(pairs[0])) == len(np.unique(pairs[1]))
+        assert len(graph) == len(expected)
+
+        renumber = np.empty(len(graph), dtype=np.int64)
+        renumber[pairs[0]] = pairs[1]
+        assert (graph.colors == expected.colors[renumber]).all()
+        assert (graph.sizes == expected.sizes[renumber]).all()
+        edges = sorted(
+            zip(renumber[graph.sources], renumber[graph.targets], graph.lengths)
+        )
+        assert edges == sorted(
+            zip(expected.sources, expected.targets, expected.lengths)
+        )
+        for region in range(len(graph)):
+            targets, lengths = graph.neighbours(region)
+            assert sorted(zip(renumber[targets], lengths)) == sorted(
+                zip(*expected.neighbours(renumber[region]))
+            )
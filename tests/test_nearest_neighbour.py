@@ -0,0 +1,135 @@
+import numpy as np
+import pytest
+from canvas import Canvas
+from nearest_neighbour import (
+    METRICS,
+    GridIndex,
+    IncrementalVoronoi,
+    jump_flooding,
+    nearest_neighbour,
+)
+
+# Including canvases with a short side shorter than the first steps of the jump flooding.
+SHAPES = [(1, 1), (9, 16), (16, 9), (27, 64), (108, 192), (5, 120), (120, 5), (1, 50)]
+
+
+def brute_force(points, height, width, metric):
+    """Return the distance to the nearest point of each pixel."""
+    ys, xs = np.mgrid[0:height, 0:width]
+    distances = METRICS[metric](
+        points[:, 0, None, None] - ys[None], points[:, 1, None, None] - xs[None]
+    )
+    return distances.min(axis=0)
+
+
+def random_points(height, width, n, rng):
+    """Draw n distinct points (y, x) on the canvas."""
+    cells = rng.choice(height * width, size=min(n, height * width), replace=False)
+    return np.column_stack(np.divmod(cells, width))
+
+
+def distances_to(points, nearest, metric):
+    """Return the distance from each pixel to the point given by nearest."""
+    ys, xs = np.indices(nearest.shape)
+    return METRICS[metric](points[nearest, 0] - ys, points[nearest, 1] - xs)
+
+
+@pytest.mark.parametrize("metric", METRICS)
+@pytest.mark.parametrize("height, width", SHAPES)
+def test_grid_index(height, width, metric):
+    rng = np.random.default_rng(height * width)
+    points = random_points(height, width, 20, rng)
+    ys, xs = np.mgrid[0:height, 0:width]
+    nearest, best = GridIndex(points, height, width).query(
+        ys.ravel(), xs.ravel(), metric
+    )
+
+    expected = brute_force(points, height, width, metric)
+    assert np.allclose(best.reshape(height, width), expected)
+    assert np.allclose(
+        distances_to(points, nearest.reshape(height, width), metric), expected
+    )
+
+
+@pytest.mark.parametrize("metric", METRICS)
+@pytest.mark.parametrize("height, width", SHAPES)
+def test_jump_flooding(height, width, metric):
+    rng = np.random.default_rng(height * width)
+    points = random_points(height, width, 20, rng)
+    nearest = jump_flooding(points, height, width, metric)
+
+    assert (nearest >= 0).all()
+    # Jump flooding is approximate, but rarely wrong.
+    exact = np.isclose(
+        distances_to(points, nearest, metric),
+        brute_force(points, height, width, metric),
+    )
+    assert exact.mean() >= 0.99
+
+
+@pytest.mark.parametrize("metric", METRICS)
+@pytest.mark.parametrize("height, width", [(9, 16), (40, 30), (108, 192), (12, 90)])
+def test_incremental_voronoi(height, width, metric):
+    rng = np.random.default_rng(height * width)
+    points = random_points(height, width, 30, rng)
+    colors = rng.integers(1, 256, size=(len(points), 3))
+    voronoi = IncrementalVoronoi(Canvas(width, height), points, colors, metric)
+
+    def check():
+        alive = np.flatnonzero(voronoi.alive)
+        expected = brute_force(voronoi.points[alive], height, width, metric)
+        assert np.allclose(voronoi.distances, expected)
+        assert voronoi.alive[voronoi.nearest].all()
+        assert np.allclose(
+            distances_to(voronoi.points, voronoi.nearest, metric), expected
+        )
+        assert (voronoi.canvas.tensor == voronoi.colors[voronoi.nearest]).all()
+
+    for _ in range(5):
+        alive = np.flatnonzero(voronoi.alive)
+        voronoi.move(
+            rng.choice(alive, size=3, replace=False),
+            random_points(height, width, 3, rng),
+        )
+        check()
+        voronoi.add(
+            random_points(height, width, 2, rng), rng.integers(1, 256, size=(2, 3))
+        )
+        check()
+        voronoi.remove(rng.choice(np.flatnonzero(voronoi.alive), size=2, replace=False))
+        check()
+
+
+@pytest.mark.parametrize("metric", METRICS)
+@pytest.mark.parametrize("height, width", [(40, 30), (27, 64)])
+def test_incremental_voronoi_matches_recompute(height, width, metric):
+    rng = np.random.default_rng(height + width)
+    points = random_points(height, width, 25, rng)
+    colors = rng.integers(1, 256, size=(len(points), 3))
+    voronoi = IncrementalVoronoi(Canvas(width, height), points, colors, metric)
+
+    for _ in range(5):
+        alive = np.flatnonzero(voronoi.alive)
+        voronoi.move(
+            rng.choice(alive, size=4, replace=False),
+            random_points(height, width, 4, rng),
+        )
+        voronoi.add(
+            random_points(height, width, 2, rng), rng.integers(1, 256, size=(2, 3))
+        )
+        voronoi.remove(rng.choice(np.flatnonzero(voronoi.alive), size=2, replace=False))
+
+        # Ties between equally near points may be broken differently, so the owners are compared by distance,
+        # and the colors where the nearest point is unique.
+        alive = np.flatnonzero(voronoi.alive)
+        expected = nearest_neighbour(
+            Canvas(width, height), voronoi.points[alive], voronoi.colors[alive], metric
+        )
+        ys, xs = np.indices((height, width))
+        distances = np.stack(
+            [METRICS[metric](y - ys, x - xs) for y, x in voronoi.points[alive]]
+        )
+        best = distances.min(axis=0)
+        unique = np.isclose(distances, best).sum(axis=0) == 1
+        assert np.allclose(voronoi.distances, best)
+        assert (voronoi.canvas.tensor[unique] == expected.tensor[unique]).all()
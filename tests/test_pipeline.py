@@ -0,0 +1,67 @@
+import numpy as np
+import pytest
+import random_walk
+from canvas import Canvas
+from pipeline import Stage, run_pipeline, stage_keys
+
+
+def counting_stages(calls, parameters):
+    """Two stages painting the canvas, which count the number of times they've been run."""
+
+    def paint(name, value):
+        def run(canvas):
+            calls[name] = calls.get(name, 0) + 1
+            canvas.paint(slice(None), slice(None), np.full(3, value, dtype="uint8"))
+            return canvas
+
+        return run
+
+    return [
+        Stage("walk", parameters, paint("walk", 1)),
+        Stage("noise", {}, paint("noise", 2)),
+    ]
+
+
+def test_changed_parameters_rerun_the_stage(tmp_path):
+    calls = {}
+    for parameters in [{"target_coverage": 0.99}, {"target_coverage": 0.99}]:
+        run_pipeline(
+            Canvas(4, 3), counting_stages(calls, parameters), tmp_path, verbose=False
+        )
+    assert calls == {"walk": 1, "noise": 1}
+
+    # Changing a parameter of the walk reruns it, along with the stages after it.
+    run_pipeline(
+        Canvas(4, 3),
+        counting_stages(calls, {"target_coverage": 0.5}),
+        tmp_path,
+        verbose=False,
+    )
+    assert calls == {"walk": 2, "noise": 2}
+
+
+@pytest.mark.parametrize("processes", [1, 4])
+@pytest.mark.parametrize(
+    "name, value",
+    [
+        ("TARGET_COVERAGE", 0.5),
+        ("NUMBER_OF_WALKERS", 7),
+        ("NUMBER_OF_STEPS", 1234),
+        ("PROBABILITY_FOR_COLOR_TO_STAY_THE_SAME", 0.5),
+    ],
+)
+def test_walk_settings_change_the_walk_key(monkeypatch, processes, name, value):
+    monkeypatch.setattr(random_walk, "NUMBER_OF_PROCESSES", processes)
+    before = stage_keys(random_walk.pipeline_stages(seed=1))
+    monkeypatch.setattr(random_walk, name, value)
+    after = stage_keys(random_walk.pipeline_stages(seed=1))
+
+    assert before[0] != after[0]
+    assert stage_keys(random_walk.pipeline_stages(seed=1)) == after
+
+
+def test_walk_without_a_seed_is_always_stale():
+    assert (
+        stage_keys(random_walk.pipeline_stages(seed=None))[0]
+        != stage_keys(random_walk.pipeline_stages(seed=None))[0]
+    )
@@ -0,0 +1,209 @@
+import numpy as np
+import pytest
+from labeling import label_groups
+from profiling import Profiler
+from canvas import Canvas
+from random_walk import (
+    PROBABILITY_FOR_COLOR_TO_STAY_THE_SAME,
+    box_sums,
+    chunked_random_walk,
+    constrain,
+    majority_filter_indices,
+    multi_walker_random_walk,
+    remove_black_pixels_indices,
+    tile_grid,
+    tiled_random_walk,
+    walk_positions,
+)
+
+
+def sequential_walk(pos, axes, signs, height, width):
+    """The positions painted by the loop of random_walk, for the given axes and signs."""
+    # The boundary check of random_walk.
+    check = lambda x, M, m: x if x >= m and x < M else (M if x < M else m)
+    pos, painted = list(pos), []
+    for axis, sign in zip(axes, signs):
+        painted.append(tuple(pos))
+        pos[axis] += sign
+        pos[0] = check(pos[0], height - 1, 0)
+        pos[1] = check(pos[1], width - 1, 0)
+
+    return np.array(painted).reshape(-1, 2), np.array(pos)
+
+
+def test_constrain():
+    upper = np.array([4, 6])
+    values = np.array([[-1, 3], [4, 6], [5, -1], [0, 5]])
+    # Stepping off the top or left wraps to the last row or column, and stepping past it wraps to the first.
+    expected = np.array([[4, 3], [0, 0], [0, 6], [0, 5]])
+    assert (constrain(values, upper) == expected).all()
+
+
+@pytest.mark.parametrize("seed", range(5))
+@pytest.mark.parametrize("height, width", [(1, 1), (1, 9), (9, 1), (3, 4), (40, 70)])
+def test_walk_positions(height, width, seed):
+    rng = np.random.default_rng(seed)
+    n = 5000
+    axes = rng.integers(0, 2, size=n)
+    signs = np.where(rng.random(n) > 0.5, 1, -1)
+    # Starting on the edges as well, where the boundary check lets the walker stay for a step.
+    for pos in [(0, 0), (height - 1, width - 1), (height // 2, width // 2)]:
+        painted, end = walk_positions(pos, axes, signs, height, width)
+        expected, expected_end = sequential_walk(pos, axes, signs, height, width)
+        assert (painted == expected).all()
+        assert (end == expected_end).all()
+
+
+@pytest.mark.parametrize("chunk_size", [1 << 20, 777])
+@pytest.mark.parametrize("height, width", [(5, 3), (30, 50)])
+def test_chunked_random_walk(height, width, chunk_size):
+    colors, ratios = [(255, 0, 0), (0, 255, 0), (0, 0, 255)], [1, 2, 3]
+    number_of_steps = 3000
+    canvas = chunked_random_walk(
+        Canvas(width, height), number_of_steps, chunk_size, False, colors, ratios, 7
+    )
+
+    # Draw the same random numbers as the chunked walk, and paint them one step at a time.
+    rng = np.random.default_rng(7)
+    pos = [rng.integers(0, height), rng.integers(0, width)]
+    weights = np.array(ratios) / sum(ratios)
+    expected = np.zeros((height, width, 3), dtype="uint8")
+    color = 0
+    for start in range(0, number_of_steps, chunk_size):
+        n = min(chunk_size, number_of_steps - start)
+        axes = rng.integers(0, 2, size=n)
+        signs = np.where(rng.random(n) > 0.5, 1, -1)
+        switches = rng.random(n) > PROBABILITY_FOR_COLOR_TO_STAY_THE_SAME
+        new_colors = iter(rng.choice(len(colors), size=switches.sum(), p=weights))
+
+        painted, pos = sequential_walk(pos, axes, signs, height, width)
+        for (y, x), switch in zip(painted, switches):
+            expected[y, x] = colors[color]
+            if switch:
+                color = next(new_colors)
+
+    assert (canvas.tensor == expected).all()
+
+
+@pytest.mark.parametrize(
+    "height, width, number_of_tiles, expected",
+    [
+        (1080, 1920, 1, (1, 1)),
+        (1080, 1920, 2, (1, 2)),
+        (1080, 1920, 8, (2, 4)),
+        (1920, 1080, 8, (4, 2)),
+        (100, 100, 7, (1, 7)),
+    ],
+)
+def test_tile_grid(height, width, number_of_tiles, expected):
+    assert tile_grid(height, width, number_of_tiles) == expected
+
+
+def test_walk_region_coverage():
+    region = (10, 30, 20, 50)
+    canvas = multi_walker_random_walk(
+        Canvas(80, 40), number_of_walkers=4, verbose=False, rng=3, region=region
+    )
+    painted = canvas.tensor.any(axis=-1)
+    # The walk stops as soon as the region is covered, which is before the whole canvas is covered.
+    assert painted[10:30, 20:50].mean() >= 0.99
+    assert painted.mean() < 0.99
+
+
+@pytest.mark.parametrize("number_of_processes", [1, 2, 3])
+def test_tiled_random_walk(number_of_processes):
+    canvas = tiled_random_walk(
+        Canvas(90, 60),
+        number_of_processes=number_of_processes,
+        number_of_walkers=8,
+        target_coverage=0.95,
+        number_of_steps=10**6,
+        overlap=4,
+        rng=5,
+    )
+    # Each tile walks until 95% of its core is painted.
+    rows, columns = tile_grid(60, 90, number_of_processes)
+    painted = canvas.tensor.any(axis=-1)
+    for ys in np.array_split(np.arange(60), rows):
+        for xs in np.array_split(np.arange(90), columns):
+            assert painted[np.ix_(ys, xs)].mean() >= 0.95
+
+
+def brute_force_majority(indices, kernel_size):
+    """Give each pixel the most common color in the window around it, clipped at the edges.
+
+    Ties are broken in favour of the current color, and otherwise in favour of the smallest color.
+    """
+    height, width = indices.shape
+    r = kernel_size // 2
+    result = indices.copy()
+    for y in range(height):
+        for x in range(width):
+            window = indices[max(y - r, 0) : y + r + 1, max(x - r, 0) : x + r + 1]
+            counts = np.bincount(window.ravel())
+            if counts[indices[y, x]] < counts.max():
+                result[y, x] = np.argmax(counts)
+
+    return result
+
+
+@pytest.mark.parametrize("kernel_size", [1, 3, 5])
+@pytest.mark.parametrize("height, width", [(1, 1), (7, 3), (20, 33)])
+def test_box_sums(height, width, kernel_size):
+    rng = np.random.default_rng(height * width + kernel_size)
+    mask = rng.random((height, width)) < 0.5
+    r = kernel_size // 2
+
+    sums = box_sums(mask, kernel_size)
+    for y in range(height):
+        for x in range(width):
+            window = mask[max(y - r, 0) : y + r + 1, max(x - r, 0) : x + r + 1]
+            assert sums[y, x] == window.sum()
+
+
+@pytest.mark.parametrize("seed", range(5))
+@pytest.mark.parametrize("kernel_size", [3, 5])
+@pytest.mark.parametrize("cutof", [None, 4])
+@pytest.mark.parametrize("iterations", [1, 3])
+def test_majority_filter(iterations, cutof, kernel_size, seed):
+    rng = np.random.default_rng(seed)
+    indices = rng.integers(1, 5, size=(24, 37)).astype(np.uint8)
+
+    expected = indices
+    for _ in range(iterations):
+        # The groups are those of the original indices, as in majority_filter_indices.
+        filtered = brute_force_majority(expected, kernel_size)
+        if cutof is not None:
+            labels, _, sizes = label_groups(indices)
+            filtered = np.where(sizes[labels] <= cutof, filtered, expected)
+        expected = filtered
+
+    result = majority_filter_indices(indices, kernel_size, iterations, cutof)
+    assert (result == expected).all()
+
+
+@pytest.mark.parametrize("height, width", [(1, 300), (60, 80), (200, 300)])
+def test_remove_black_pixels_large_region(height, width):
+    # A single painted pixel, which has to be spread over the whole black canvas.
+    indices = np.zeros((height, width), dtype=np.uint8)
+    indices[height // 3, width // 4] = 1
+    is_black = np.array([True, False])
+
+    with Profiler().stage("black-pixels") as counters:
+        result = remove_black_pixels_indices(indices, is_black, 0)
+
+    assert (result == 1).all()
+    # Each black pixel is examined a bounded number of times, no matter how many passes the fill takes.
+    assert counters["passes"] >= (height + width) // 2
+    assert counters["examined_pixels"] <= 3 * indices.size
+    assert counters["unfilled_black_pixels"] == 0
+
+
+def test_remove_black_pixels_unreachable():
+    # The black pixels of a tile without painted pixels are left for the neighbouring tiles.
+    indices = np.zeros((5, 7), dtype=np.uint8)
+    with Profiler().stage("black-pixels") as counters:
+        result = remove_black_pixels_indices(indices, np.array([True, False]), 0)
+
+    assert (result == 0).all()
+    assert counters["unfilled_black_pixels"] == indices.size
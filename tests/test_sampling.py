@@ -0,0 +1,17 @@
+import numpy as np
+import pytest
+from sampling import poisson_disc_points, poisson_disc_radius
+
+
+@pytest.mark.parametrize(
+    "width, height, n", [(192, 108, 200), (64, 300, 100), (500, 40, 400), (50, 50, 800)]
+)
+def test_poisson_disc_spacing(width, height, n):
+    radius = poisson_disc_radius(width, height, n)
+    points = poisson_disc_points(width, height, radius, rng=n)
+
+    assert ((points >= 0) & (points < [height, width])).all()
+    differences = points[:, None] - points[None]
+    distances = np.sqrt((differences.astype(np.float64) ** 2).sum(axis=-1))
+    np.fill_diagonal(distances, np.inf)
+    assert distances.min() >= radius